@@ -0,0 +1,93 @@
+var COMPARE_COLORS = ['#38D56F', '#9A38D5', '#FFA07A', '#006fe6', '#D5386F', '#38B0D5',
+                      '#D5A738', '#6F38D5', '#8C8C8C', '#1f2c56'];
+
+// Past this many points in view a trace drops its value labels, which
+// would only overlap and cost render time.
+var TEXT_LABEL_LIMIT = 40;
+
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    line_chart: {
+        // Builds the line_chart figure from the full series of the selected
+        // countries and the prebuilt template of the selected metric. Moving
+        // the year slider or switching radio_items only re-slices what the
+        // browser already holds, so neither round-trips to the server.
+        render: function(data, select_years, radio_items, templates) {
+            if (!data || !select_years || !templates || !templates[radio_items]) {
+                return window.dash_clientside.no_update;
+            }
+            var template = templates[radio_items];
+            var compare = data.series.length > 1;
+
+            var traces = data.series.map(function(series, n) {
+                var x = [], y = [];
+                series.year.forEach(function(year, i) {
+                    if (year >= select_years[0] && year <= select_years[1]) {
+                        x.push(year);
+                        y.push(series[template.column][i]);
+                    }
+                });
+
+                // The hovertemplate formats the raw x/y values and reads
+                // country and continent from meta, so no hover strings are
+                // built here.
+                var trace = Object.assign({}, template.trace, {
+                    x: x, y: y, text: y, name: series.country,
+                    meta: [series.country, data.continent]
+                });
+                if (x.length > TEXT_LABEL_LIMIT) {
+                    trace.mode = 'markers+lines';
+                    delete trace.text;
+                }
+                if (compare) {
+                    // One colour per country and no point labels, which
+                    // would pile up on top of each other.
+                    var color = COMPARE_COLORS[n % COMPARE_COLORS.length];
+                    trace.mode = 'markers+lines';
+                    trace.line = Object.assign({}, trace.line, {color: color, width: 2});
+                    trace.marker = Object.assign({}, trace.marker, {color: color, size: 6,
+                                                                    line: {color: color, width: 1}});
+                }
+                return trace;
+            });
+
+            // plotly.js writes autorange results back into the layout it is
+            // given, so each render gets its own copy of the template.
+            var layout = JSON.parse(JSON.stringify(template.layout));
+            layout.title.text = template.title + ' ' + select_years.join(' to ');
+            layout.showlegend = compare;
+            // Keep the user's zoom while a more detailed series for it
+            // arrives or the metric changes; a new selection resets it.
+            layout.uirevision = [data.continent, select_years.join('-')].concat(
+                data.series.map(function(series) { return series.country; })).join('|');
+            if (compare) {
+                layout.legend.y = -0.2;
+            }
+
+            return {data: traces, layout: layout};
+        },
+
+        // Where each trace drawn by render ends, so stream_points only
+        // sends what comes after. Every render starts the stream over, as
+        // it redraws from the series alone.
+        stream_base: function(data, select_years, radio_items, templates) {
+            if (!data || !select_years || !templates || !templates[radio_items]) {
+                return null;
+            }
+            var last = data.series.map(function(series) {
+                return series.year.length ? series.year[series.year.length - 1] : null;
+            });
+            var end = Math.max.apply(null, last.filter(function(year) { return year !== null; }));
+            return {
+                continent: data.continent,
+                countries: data.series.map(function(series) { return series.country; }),
+                column: templates[radio_items].column,
+                from: select_years[0],
+                to: select_years[1],
+                last: last,
+                // With the slider at the end of the data, new years are
+                // followed past it.
+                follow: select_years[1] >= end
+            };
+        }
+    }
+});
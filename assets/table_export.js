@@ -0,0 +1,23 @@
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    table_export: {
+        // Download links for the rows behind my_datatable. The server
+        // streams the export, so the browser only ever holds the page it
+        // shows; with no country selected the whole continent is exported.
+        links: function(continent, countries, select_years, sort_by) {
+            var params = [['continent', continent || '']];
+            [].concat(countries || []).forEach(function(country) {
+                params.push(['country', country]);
+            });
+            if (select_years) {
+                params.push(['from', select_years[0]], ['to', select_years[1]]);
+            }
+            (sort_by || []).forEach(function(column) {
+                params.push(['sort', column.column_id + ':' + column.direction]);
+            });
+            var query = params.map(function(param) {
+                return encodeURIComponent(param[0]) + '=' + encodeURIComponent(param[1]);
+            }).join('&');
+            return ['/export/table.csv?' + query, '/export/table.parquet?' + query];
+        }
+    }
+});
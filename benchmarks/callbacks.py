@@ -0,0 +1,229 @@
+"""Replay interaction traces against the Dash callback endpoint.
+
+Each trace is a list of steps; a step sets component properties the way a
+user would, then every server callback whose inputs changed is posted to
+``/_dash-update-component`` through the Flask test client, following the
+chain of outputs exactly as the browser would. Latency percentiles and
+response sizes are reported per callback.
+
+    python benchmarks/callbacks.py --rows 1000000 --sessions 20
+    python benchmarks/callbacks.py --data data/panel.csv --record trace.json
+    python benchmarks/callbacks.py --replay trace.json --no-cache
+"""
+import argparse
+import collections
+import json
+import os
+import pathlib
+import random
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+
+class Session:
+    """Browser stand-in holding component state and firing callbacks."""
+
+    def __init__(self, client, dependencies, state, timings):
+        self.client = client
+        self.dependencies = dependencies
+        self.state = dict(state)
+        self.timings = timings
+
+    def apply(self, changes, initial=False):
+        """Set ``changes`` and fire what depends on them, wave by wave as the renderer does.
+
+        Every callback is told which of its inputs changed, so it sees the
+        trigger the browser would give it; on ``initial`` page load, none.
+        Unless the step is a cancel click, jobs left running by the previous
+        step are polled to completion first, as a user waits for a result.
+        """
+        if not any(prop.endswith('_cancel.n_clicks') for prop in changes):
+            self.settle()
+        self._fire(changes, initial)
+
+    def settle(self, interval=0.05, timeout=600):
+        """Tick ``job_poll`` until no chart or table job is pending."""
+        deadline = time.perf_counter() + timeout
+        while (self.state.get('chart_job.data') or self.state.get('table_job.data')) and \
+                time.perf_counter() < deadline:
+            time.sleep(interval)
+            self._fire({'job_poll.n_intervals': (self.state.get('job_poll.n_intervals') or 0) + 1})
+
+    def _fire(self, changes, initial=False):
+        self.state.update(changes)
+        changed = list(changes)
+        fired = set()
+        while changed:
+            following = []
+            for dependency in self.dependencies:
+                output = dependency['output']
+                inputs = [_prop(i) for i in dependency['inputs']]
+                triggers = [prop for prop in changed if prop in inputs]
+                if output in fired or not triggers:
+                    continue
+                fired.add(output)
+                if dependency.get('clientside_function'):
+                    self.timings['clientside ' + output].append((0.0, 0))
+                    continue
+                following.extend(self.call(dependency, [] if initial else triggers))
+            changed = following
+
+    def call(self, dependency, triggers):
+        output = dependency['output']
+        multi = output.startswith('..')
+        outputs = [_split(o) for o in output.strip('.').split('...')] if multi else _split(output)
+        body = {
+            'output': output,
+            'outputs': outputs,
+            'inputs': [dict(i, value=self.state.get(_prop(i))) for i in dependency['inputs']],
+            'state': [dict(s, value=self.state.get(_prop(s))) for s in dependency['state']],
+            'changedPropIds': triggers,
+        }
+        start = time.perf_counter()
+        response = self.client.post('/_dash-update-component', json=body)
+        elapsed = time.perf_counter() - start
+        self.timings[output].append((elapsed, len(response.data)))
+
+        if response.status_code != 200:
+            return []
+        changed = []
+        for component, props in json.loads(response.data)['response'].items():
+            for name, value in props.items():
+                self.state[component + '.' + name] = value
+                changed.append(component + '.' + name)
+        return changed
+
+
+def make_trace(countries, years, rng, drags=10, compare=1):
+    """One user session: continent, countries, slider drag, zoom, metric, table and cancel steps."""
+    continent = rng.choice(sorted(countries))
+    trace = [{'select_continent.value': continent},
+             {'select_countries.value': rng.sample(countries[continent], min(compare, len(countries[continent])))}]
+
+    low, high = sorted(rng.sample(range(len(years)), 2))
+    for step in range(drags):
+        high = min(len(years) - 1, max(low, high + rng.choice([-1, 1])))
+        trace.append({'select_years.value': [years[low], years[high]]})
+    trace.append({'line_chart.relayoutData': {'xaxis.range[0]': years[low], 'xaxis.range[1]': years[high]}})
+
+    for metric in ['population', 'gdp_Per_cap', 'life_expectancy']:
+        trace.append({'radio_items.value': metric})
+    trace.append({'my_datatable.sort_by': [{'column_id': 'pop', 'direction': 'desc'}]})
+    trace.append({'my_datatable.page_current': 1})
+    trace.append({'my_datatable.sort_by': [{'column_id': 'lifeExp', 'direction': 'asc'}]})
+    trace.append({'table_cancel.n_clicks': 1})
+    return trace
+
+
+def initial_state(component, state=None):
+    """Property values of every component with an id, as the page loads them."""
+    state = {} if state is None else state
+    props = component.to_plotly_json()['props'] if hasattr(component, 'to_plotly_json') else {}
+    if 'id' in props:
+        for name, value in props.items():
+            if name not in ('id', 'children'):
+                state[props['id'] + '.' + name] = value
+    children = props.get('children')
+    for child in children if isinstance(children, (list, tuple)) else [children]:
+        if hasattr(child, 'to_plotly_json'):
+            initial_state(child, state)
+    return state
+
+
+def report(timings):
+    rows = []
+    for output, samples in sorted(timings.items()):
+        latency = np.array([s[0] for s in samples]) * 1000
+        size = np.array([s[1] for s in samples])
+        rows.append({'callback': output, 'calls': len(samples),
+                     'p50_ms': float(np.percentile(latency, 50)),
+                     'p95_ms': float(np.percentile(latency, 95)),
+                     'p99_ms': float(np.percentile(latency, 99)),
+                     'mean_bytes': float(size.mean()), 'max_bytes': int(size.max())})
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--data', help='CSV to serve (default: the bundled gapminder file)')
+    parser.add_argument('--rows', type=int, help='generate a synthetic panel of this many rows')
+    parser.add_argument('--backend', choices=['memory', 'sqlite'], default='memory', help='data backend to query')
+    parser.add_argument('--sessions', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--compare', type=int, default=1, help='countries selected per session')
+    parser.add_argument('--record', help='write the generated traces to this JSON file')
+    parser.add_argument('--replay', help='replay traces from this JSON file')
+    parser.add_argument('--no-cache', action='store_true', help='bypass the callback memoization cache')
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='dashboard-bench-')
+    if args.rows:
+        from benchmarks.synthetic import generate
+        args.data = os.path.join(workdir, 'synthetic.csv')
+        generate(args.rows, args.data)
+    if args.data:
+        os.environ['DASHBOARD_DATA'] = str(pathlib.Path(args.data).resolve())
+    os.environ['DASHBOARD_BACKEND'] = args.backend
+    os.environ['DASHBOARD_CACHE'] = os.path.join(workdir, 'cache.sqlite')
+
+    start = time.perf_counter()
+    import index
+    startup = time.perf_counter() - start
+    index.memoize.enabled = not args.no_cache
+
+    client = index.app.server.test_client()
+    dependencies = json.loads(client.get('/_dash-dependencies').data)
+    state = initial_state(index.app.layout)
+
+    if args.replay:
+        with open(args.replay) as f:
+            traces = json.load(f)
+    else:
+        rng = random.Random(args.seed)
+        countries = {c: index.cube.countries(c) for c in data_continents(index)}
+        traces = [make_trace(countries, index.year_list, rng, compare=args.compare) for _ in range(args.sessions)]
+    if args.record:
+        with open(args.record, 'w') as f:
+            json.dump(traces, f)
+
+    timings = collections.defaultdict(list)
+    for trace in traces:
+        session = Session(client, dependencies, state, timings)
+        session.apply(dict(state), initial=True)
+        for step in trace:
+            session.apply(step)
+        session.settle()
+
+    rows = report(timings)
+    if args.json:
+        print(json.dumps({'startup_s': startup, 'callbacks': rows}, indent=2))
+        return
+    print('startup: %.3f s, rows: %d' % (startup, len(index.cube)))
+    print('%-60s %6s %9s %9s %9s %11s' % ('callback', 'calls', 'p50 ms', 'p95 ms', 'p99 ms', 'mean bytes'))
+    for row in rows:
+        print('%-60s %6d %9.2f %9.2f %9.2f %11.0f' % (row['callback'][:60], row['calls'], row['p50_ms'],
+                                                     row['p95_ms'], row['p99_ms'], row['mean_bytes']))
+
+
+def data_continents(index):
+    return [option['value'] for option in initial_state(index.app.layout)['select_continent.options']]
+
+
+def _prop(dependency):
+    return dependency['id'] + '.' + dependency['property']
+
+
+def _split(output):
+    component, prop = output.split('.')
+    return {'id': component, 'property': prop}
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,290 @@
+"""Check the data backends against each other and against brute force.
+
+Runs four checks and stops with an AssertionError at the first mismatch:
+
+* ``index``: ``RangeMaxIndex`` queries, and its ``shifted``, ``spread`` and
+  ``raised`` updates, against a scan of every window of random data;
+* ``backends``: the in-memory cube against the SQLite one, on random
+  top-N, count, table and series queries over a synthetic panel of
+  ``--rows`` rows or the ``--data`` CSV;
+* ``append``: both backends after rows are appended to the CSV, partial
+  lines included, and dropped in as files, with new countries, continents
+  and years, against a cube built from scratch on the same rows; then
+  reopened from the store, after a dropped file is replaced and after the
+  CSV is rewritten;
+* ``cache``: the app's memoized callbacks, with the cache and a warm store
+  filled, against uncached calls after a refresh adds rows for other
+  countries of the same continent.
+
+    python benchmarks/check_cube.py
+    python benchmarks/check_cube.py --rows 1000000 --queries 1000
+    python benchmarks/check_cube.py --data data/panel.csv --only backends
+"""
+import argparse
+import json
+import math
+import os
+import pathlib
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from data_access import METRICS, RangeMaxIndex, open_cube, refresh_cube  # noqa: E402
+
+SOURCE = ROOT / 'data' / 'gapminderDataFiveYear.csv'
+
+
+def check_index(rng, rounds=200):
+    """``RangeMaxIndex`` against the row a scan of the window picks."""
+    for _ in range(rounds):
+        size = rng.randint(1, 40)
+        count = rng.randint(0, 3 * size)
+        rows = np.array(rng.sample(range(4 * count + 1), count), dtype=np.int64)
+        positions = np.array([rng.randrange(size) for _ in range(count)], dtype=np.int64)
+        values = _values(rng, count)
+        index = RangeMaxIndex(rows, positions, values, size)
+        _same_index(index, rows, positions, values, size)
+
+        # Rows inserted before existing ones, and some of those raised.
+        inserted = np.sort(np.array([rng.randint(0, 4 * count + 1) for _ in range(rng.randint(0, 5))],
+                                    dtype=np.int64))
+        moved = rows + np.searchsorted(inserted, rows, side='right')
+        new_rows = inserted + np.arange(len(inserted))
+        new_positions = np.array([rng.randrange(size) for _ in new_rows], dtype=np.int64)
+        new_values = _values(rng, len(new_rows))
+        raised = rng.sample(range(count), rng.randint(0, count))
+        higher = values.copy()
+        higher[raised] = np.fmax(values[raised], 0) + np.array([rng.choice([0, 1, 5]) for _ in raised])
+
+        changed = np.concatenate([moved[raised], new_rows])
+        index = index.shifted(inserted).raised(changed, np.concatenate([positions[raised], new_positions]),
+                                               np.concatenate([higher[raised], new_values]))
+        _same_index(index, np.concatenate([moved, new_rows]), np.concatenate([positions, new_positions]),
+                    np.concatenate([higher, new_values]), size)
+
+        # Years added around the existing ones.
+        wider = size + rng.randint(0, 5)
+        spread = np.sort(np.array(rng.sample(range(wider), size), dtype=np.int64))
+        _same_index(RangeMaxIndex(rows, positions, values, size).spread(spread, wider),
+                    rows, spread[positions], values, wider)
+
+
+def _values(rng, count):
+    # Few distinct values, so ties are common, and some missing.
+    return np.array([rng.choice([float('nan'), 0.0, 1.0, 2.0, 3.0, rng.random()]) for _ in range(count)])
+
+
+def _same_index(index, rows, positions, values, size):
+    scores = np.where(np.isnan(values), -np.inf, values)
+    for start in range(size):
+        for stop in range(start, size):
+            inside = np.flatnonzero((positions >= start) & (positions <= stop))
+            expected = -1
+            if len(inside):
+                best = max(inside, key=lambda i: (scores[i], -rows[i]))
+                expected = int(rows[best])
+            got = index.query(start, stop)
+            _expect(got == expected, 'range max over %d..%d: %d, expected %d' % (start, stop, got, expected))
+
+
+def check_backends(csv_path, rng, queries):
+    """Every query of the in-memory cube against the SQLite cube."""
+    start = time.perf_counter()
+    memory, sqlite = open_cube(csv_path, 'memory'), open_cube(csv_path, 'sqlite')
+    print('opened %d rows in %.1f s' % (len(memory), time.perf_counter() - start))
+    _same_cubes(memory, sqlite, rng, queries, exact=True)
+
+
+def check_append(workdir, rng, queries):
+    """Cubes refreshed with appended and dropped rows against cubes built on all rows at once."""
+    lines = [line for line in SOURCE.read_text().splitlines()[1:] if line.count(',') == 5]
+    extra = []
+    for _ in range(40):
+        country, year, pop, continent, life, gdp = rng.choice(lines).split(',')
+        extra.append(','.join([country, str(rng.choice([int(year), 1947, 2012, 2017])), str(rng.randint(1, 10 ** 6)),
+                               continent, '%.3f' % rng.uniform(30, 90), '%.2f' % rng.uniform(100, 10 ** 5)]))
+    extra += ['Atlantis,2007,5000,Oceania,88.5,99999.5', 'Zed,1952,7,Antarctica,,12.5', 'Aaland,2007,10,Europe,80,5']
+
+    csv_path = workdir / 'append' / 'data.csv'
+    drop_dir = workdir / 'append' / 'drop'
+    drop_dir.mkdir(parents=True)
+    shutil.copy(SOURCE, csv_path)
+    cubes = {backend: open_cube(csv_path, backend, drop_dir) for backend in ('memory', 'sqlite')}
+
+    # A last line still being written is left for the next refresh.
+    with open(csv_path, 'a') as f:
+        f.write('\n'.join(extra[:20]) + '\n' + extra[20])
+    cubes = {backend: refresh_cube(cube, csv_path, backend, drop_dir) for backend, cube in cubes.items()}
+    with open(csv_path, 'a') as f:
+        f.write('\n' + '\n'.join(extra[21:30]) + '\n')
+    reordered = [line.split(',') for line in extra[30:]]
+    (drop_dir / 'late.csv').write_text('year,country,continent,pop,lifeExp,gdpPercap\n' + ''.join(
+        ','.join([year, country, continent, pop, life, gdp]) + '\n'
+        for country, year, pop, continent, life, gdp in reordered))
+    cubes = {backend: refresh_cube(cube, csv_path, backend, drop_dir) for backend, cube in cubes.items()}
+
+    rebuilt = workdir / 'rebuilt' / 'data.csv'
+    rebuilt.parent.mkdir()
+    rebuilt.write_text(SOURCE.read_text() + '\n'.join(extra) + '\n')
+    expected = open_cube(rebuilt, 'memory')
+    for backend, cube in cubes.items():
+        _same_cubes(expected, cube, rng, queries)
+        # Reopened from what the refresh left in the store, as a new worker does.
+        _same_cubes(expected, open_cube(csv_path, backend, drop_dir), rng, queries)
+        _same_cubes(expected, open_cube(csv_path, backend, drop_dir), rng, queries)
+
+    # A dropped file replaced under the same name is read again, not skipped.
+    (drop_dir / 'late.csv').write_text('year,country,continent,pop,lifeExp,gdpPercap\n2007,Zed,Antarctica,9,,1\n')
+    rebuilt.write_text(SOURCE.read_text() + '\n'.join(extra[:30] + ['Zed,2007,9,Antarctica,,1']) + '\n')
+    expected = open_cube(rebuilt, 'memory')
+    cubes = {backend: refresh_cube(cube, csv_path, backend, drop_dir) or cube for backend, cube in cubes.items()}
+    for backend, cube in cubes.items():
+        _same_cubes(expected, cube, rng, queries)
+
+    csv_path.write_text(csv_path.read_text().replace('Afghanistan', 'Kabulistan'))
+    for backend, cube in cubes.items():
+        fresh = refresh_cube(cube, csv_path, backend, drop_dir)
+        _expect(fresh.version != cube.version and 'Kabulistan' in fresh.countries('Asia'),
+                '%s cube kept its rows after the CSV was rewritten' % backend)
+
+
+def check_cache(workdir):
+    """Memoized callback results against fresh ones once a refresh changes the continent they read."""
+    csv_path = workdir / 'cache' / 'data.csv'
+    csv_path.parent.mkdir()
+    shutil.copy(SOURCE, csv_path)
+    os.environ.update(DASHBOARD_DATA=str(csv_path), DASHBOARD_BACKEND='memory',
+                      DASHBOARD_CACHE=str(workdir / 'cache' / 'cache.sqlite'),
+                      DASHBOARD_JOBS=str(workdir / 'cache' / 'jobs.sqlite'))
+    os.environ.pop('DASHBOARD_DROP', None)
+    import index
+    import warm
+    from cache import WarmStore
+
+    countries = index.cube.countries('Asia')[:5]
+    states = [('kpi_cards', ('Asia', span)) for span in ([2002, 2007], [2007, 2007], [1952, 2007])]
+    states += [('series_data', ('Asia', [country], None)) for country in countries]
+    states += [('table_page', ('Asia', [country], span, 0, 15, sort_by))
+               for country in countries for span in ([2007, 2007], [1952, 2007])
+               for sort_by in ([], [{'column_id': 'pop_rank', 'direction': 'asc'}])]
+
+    # Every state is served from the warm store first, then from the cache.
+    index.memoize.store.recheck = 0
+    WarmStore.write(index.memoize.store.path, map(warm.render, states))
+    before = [_json(getattr(index, name)(*args)) for name, args in states]
+    _expect(index.memoize.counters['store_hits'] == len(states), 'warm store was not used')
+
+    # Outranks every country of Asia in 2007 without touching their rows.
+    with open(csv_path, 'a') as f:
+        f.write('Giant,2007,9000000000,Asia,90,100000\n')
+    _expect(index.refresh_data(), 'appended row was not picked up')
+    changed = 0
+    for (name, args), old in zip(states, before):
+        cached, fresh = getattr(index, name)(*args), getattr(index, name).__wrapped__(*args)
+        _same(_json(fresh), _json(cached), True, name, *args)
+        changed += _json(fresh) != old
+    _expect(changed, 'the appended row changed no result')
+
+
+def _json(value):
+    # Dash components and NaN as the browser gets them.
+    import plotly.utils
+    return json.loads(json.dumps(value, cls=plotly.utils.PlotlyJSONEncoder))
+
+
+def _same_cubes(expected, cube, rng, queries, exact=False):
+    _expect(expected.years == cube.years, 'years differ: %r, %r' % (expected.years, cube.years))
+    _expect(sorted(expected.continents) == sorted(cube.continents),
+            'continents differ: %r, %r' % (expected.continents, cube.continents))
+    _expect(len(expected) == len(cube), 'row counts differ: %d, %d' % (len(expected), len(cube)))
+    for _ in range(queries):
+        continent = rng.choice(expected.continents)
+        countries = expected.countries(continent)
+        _expect(countries == cube.countries(continent), 'countries of %s differ' % continent)
+        chosen = rng.sample(countries, min(len(countries), rng.randint(1, 4)))
+        years = sorted(rng.sample(expected.years, 2)) if len(expected.years) > 1 else expected.years * 2
+        for metric in METRICS:
+            _same(expected.top(continent, metric, years), cube.top(continent, metric, years), exact,
+                  'top', continent, metric, years)
+        _same(expected.count(continent, chosen, years), cube.count(continent, chosen, years), exact,
+              'count', continent, chosen, years)
+        sort_by = [{'column_id': name, 'direction': rng.choice(['asc', 'desc'])}
+                   for name in rng.sample(expected.names, rng.randint(0, 2))]
+        start = rng.randint(0, 40)
+        _same(expected.table(continent, chosen, years, sort_by, start, start + 15),
+              cube.table(continent, chosen, years, sort_by, start, start + 15), exact,
+              'table', continent, chosen, years, sort_by, start)
+        window = years if rng.random() < 0.5 else None
+        _same(expected.series(continent, chosen, points=500, window=window),
+              cube.series(continent, chosen, points=500, window=window), exact,
+              'series', continent, chosen, window)
+
+
+def _same(expected, got, exact, *query):
+    _expect(_equal(expected, got, exact), '%s: %r, expected %r' % (' '.join(map(str, query)), got, expected))
+
+
+def _equal(a, b, exact):
+    if isinstance(a, dict):
+        return isinstance(b, dict) and a.keys() == b.keys() and all(_equal(a[k], b[k], exact) for k in a)
+    if isinstance(a, list):
+        return isinstance(b, list) and len(a) == len(b) and all(_equal(x, y, exact) for x, y in zip(a, b))
+    # Missing values come back as None from SQLite and as NaN from numpy.
+    a, b = (float('nan') if value is None else value for value in (a, b))
+    if isinstance(a, float) and isinstance(b, float) and math.isnan(a) and math.isnan(b):
+        return True
+    if not exact and isinstance(a, float) and isinstance(b, (int, float)):
+        # Sums taken in another order.
+        return abs(a - b) <= 1e-6 * max(1.0, abs(a))
+    return a == b
+
+
+def _expect(condition, message):
+    if not condition:
+        raise AssertionError(message)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--data', help='CSV for the backends check (default: a synthetic panel)')
+    parser.add_argument('--rows', type=int, default=200000, help='rows of the synthetic panel')
+    parser.add_argument('--queries', type=int, default=300, help='random queries per comparison')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--only', choices=['index', 'backends', 'append', 'cache'], action='append',
+                        help='run only this check (repeatable)')
+    args = parser.parse_args()
+    checks = args.only or ['index', 'backends', 'append', 'cache']
+
+    rng = random.Random(args.seed)
+    workdir = pathlib.Path(tempfile.mkdtemp(prefix='dashboard-check-'))
+    try:
+        if 'index' in checks:
+            check_index(rng)
+            print('index: ok')
+        if 'backends' in checks:
+            if not args.data:
+                from benchmarks.synthetic import generate
+                args.data = workdir / 'synthetic' / 'panel.csv'
+                args.data.parent.mkdir()
+                generate(args.rows, args.data, seed=args.seed)
+            check_backends(args.data, rng, args.queries)
+            print('backends: ok')
+        if 'append' in checks:
+            check_append(workdir, rng, args.queries)
+            print('append: ok')
+        if 'cache' in checks:
+            check_cache(workdir)
+            print('cache: ok')
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
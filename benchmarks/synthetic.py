@@ -0,0 +1,57 @@
+"""Generate gapminder-shaped panels of any size for benchmarking.
+
+Countries of the real dataset are cloned with a numeric suffix and given
+yearly observations drawn as random walks around their real starting
+values, so continents, value ranges and the column layout stay realistic.
+
+    python benchmarks/synthetic.py 1000000 data/synthetic-1m.csv
+"""
+import argparse
+import pathlib
+
+import numpy as np
+import pandas as pd
+
+
+SOURCE = pathlib.Path(__file__).resolve().parent.parent / 'data' / 'gapminderDataFiveYear.csv'
+
+
+def generate(rows, path, years=56, first_year=1952, seed=0, chunk_rows=10 ** 6):
+    """Write a CSV of about ``rows`` rows (whole countries of ``years`` each)."""
+    rng = np.random.default_rng(seed)
+    base = pd.read_csv(SOURCE).sort_values(['country', 'year']).groupby('country').first()
+    countries = max(1, -(-rows // years))
+    per_chunk = max(1, chunk_rows // years)
+    year = np.arange(first_year, first_year + years)
+
+    header = True
+    for start in range(0, countries, per_chunk):
+        ids = np.arange(start, min(start + per_chunk, countries))
+        template = base.iloc[ids % len(base)]
+        size = len(ids)
+
+        def walk(initial, drift, scale):
+            steps = rng.normal(drift, scale, size=(size, years))
+            steps[:, 0] = 0
+            return initial[:, None] * np.exp(np.cumsum(steps, axis=1))
+
+        chunk = pd.DataFrame({
+            'country': np.repeat([name + ' ' + str(i // len(base)) for name, i in zip(template.index, ids)], years),
+            'year': np.tile(year, size),
+            'pop': walk(template['pop'].to_numpy(), 0.02, 0.01).round().ravel(),
+            'continent': np.repeat(template['continent'].to_numpy(), years),
+            'lifeExp': np.minimum(walk(template['lifeExp'].to_numpy(), 0.004, 0.005), 90).ravel(),
+            'gdpPercap': walk(template['gdpPercap'].to_numpy(), 0.02, 0.05).ravel(),
+        })
+        chunk.to_csv(path, mode='w' if header else 'a', header=header, index=False)
+        header = False
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('rows', type=int)
+    parser.add_argument('path')
+    parser.add_argument('--years', type=int, default=56)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    generate(args.rows, args.path, years=args.years, seed=args.seed)
@@ -0,0 +1,271 @@
+import collections
+import functools
+import json
+import mmap
+import os
+import pickle
+import sqlite3
+import tempfile
+import struct
+import threading
+import time
+import uuid
+
+import flask
+
+
+class Memoizer:
+    """Two-level LRU cache for callback results.
+
+    Each process keeps its most recent results in memory; behind that sits
+    a SQLite file shared by every worker on the host, so a result computed
+    by one worker is a hit for the others. Entries are keyed by the callback
+    name, the result format, the data version and the JSON-normalized
+    arguments. The format is given to ``init_app`` and has to change
+    whenever a callback's results do, since the data version outlives a
+    deploy and so does the shared file.
+
+    An optional read-only ``store`` of pre-rendered results (see
+    ``warm.py``) is consulted between the two.
+
+    Functions decorated through ``scoped`` are also keyed by a version of
+    just the data they read, so appending rows leaves the entries of
+    everything else valid.
+    """
+
+    def __init__(self, path=None, max_entries=1024, max_bytes=256 * 2 ** 20):
+        self.path = path or os.environ.get('DASHBOARD_CACHE') or os.path.join(
+            tempfile.gettempdir(), 'dashboard-cache.sqlite')
+        self.max_entries = max_entries
+        self.max_bytes = int(os.environ.get('DASHBOARD_CACHE_MB', 0)) * 2 ** 20 or max_bytes
+        self.version = ''
+        self.format = 0
+        self.enabled = True
+        self.store = None
+        self._scopes = {}
+
+        self._lock = threading.Lock()
+        self._local = collections.OrderedDict()
+        self._connections = threading.local()
+        self.counters = collections.Counter()
+
+    def __call__(self, func):
+        @functools.wraps(func)
+        def wrapper(*args):
+            if not self.enabled:
+                return func(*args)
+            key = self.key(func.__name__, args)
+            found, value = self.get(key)
+            if found:
+                return value
+            value = func(*args)
+            self.set(key, value)
+            return value
+
+        return wrapper
+
+    def scoped(self, version):
+        """Memoize a function, keyed by ``version(*args)`` on top of the data version."""
+        def decorate(func):
+            self._scopes[func.__name__] = version
+            return self(func)
+
+        return decorate
+
+    def key(self, name, args):
+        version = self.version
+        if name in self._scopes:
+            version = '%s/%s' % (version, self._scopes[name](*args))
+        return json.dumps([name, self.format, version, args], sort_keys=True, default=str)
+
+    def lookup(self, func, *args):
+        """``(found, value)`` of the memoized ``func`` for ``args``, without calling it on a miss.
+
+        The miss is not counted; calling ``func`` after it counts it.
+        """
+        if not self.enabled:
+            return False, None
+        return self.get(self.key(func.__name__, args), count_miss=False)
+
+    def get(self, key, count_miss=True):
+        with self._lock:
+            if key in self._local:
+                self._local.move_to_end(key)
+                self.counters['local_hits'] += 1
+                return True, self._local[key]
+
+        if self.store is not None:
+            found, value = self.store.get(key)
+            if found:
+                with self._lock:
+                    self.counters['store_hits'] += 1
+                    self._remember(key, value)
+                return True, value
+
+        db = self._db()
+        row = db.execute('SELECT value FROM cache WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            with self._lock:
+                self.counters['misses'] += count_miss
+            return False, None
+
+        db.execute('UPDATE cache SET used = ? WHERE key = ?', (time.time(), key))
+        value = pickle.loads(row[0])
+        with self._lock:
+            self.counters['shared_hits'] += 1
+            self._remember(key, value)
+        return True, value
+
+    def set(self, key, value):
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        db = self._db()
+        db.execute('INSERT INTO cache (key, value, size, used) VALUES (?, ?, ?, ?) ON CONFLICT (key) '
+                   'DO UPDATE SET value = excluded.value, size = excluded.size, used = excluded.used',
+                   (key, blob, len(blob), time.time()))
+        total, = db.execute('SELECT bytes FROM cache_total').fetchone()
+        evicted = 0
+        if total > self.max_bytes:
+            # Drop the least recently used tenth of the entries at a time.
+            evicted = db.execute('DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY used '
+                                 'LIMIT MAX(1, (SELECT COUNT(*) FROM cache) / 10))').rowcount
+        with self._lock:
+            self.counters['shared_evictions'] += evicted
+            self._remember(key, value)
+
+    def clear(self):
+        with self._lock:
+            self._local.clear()
+        self._db().execute('DELETE FROM cache')
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters, local_entries=len(self._local))
+        entries, size = self._db().execute('SELECT (SELECT COUNT(*) FROM cache), bytes FROM cache_total').fetchone()
+        stats.update(shared_entries=entries, shared_bytes=size)
+        if self.store is not None:
+            stats.update(store_entries=len(self.store))
+        return stats
+
+    def init_app(self, server, version='', store=None, format=0):
+        self.version = version
+        self.format = format
+        self.store = store
+        server.add_url_rule('/_cache-stats', 'cache_stats', lambda: flask.jsonify(self.stats()))
+
+    def _remember(self, key, value):
+        self._local[key] = value
+        self._local.move_to_end(key)
+        while len(self._local) > self.max_entries:
+            self._local.popitem(last=False)
+            self.counters['local_evictions'] += 1
+
+    def _db(self):
+        db = getattr(self._connections, 'db', None)
+        if db is None or self._connections.pid != os.getpid():
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            db.execute('CREATE TABLE IF NOT EXISTS cache '
+                       '(key TEXT PRIMARY KEY, value BLOB, size INTEGER, used REAL)')
+            db.execute('CREATE INDEX IF NOT EXISTS cache_used ON cache (used)')
+            # The size of all entries, kept up to date by triggers so that
+            # checking it against max_bytes does not scan the table.
+            db.execute('BEGIN IMMEDIATE')
+            db.execute('CREATE TABLE IF NOT EXISTS cache_total (bytes INTEGER)')
+            db.execute('INSERT INTO cache_total SELECT COALESCE(SUM(size), 0) FROM cache '
+                       'WHERE NOT EXISTS (SELECT 1 FROM cache_total)')
+            db.execute('CREATE TRIGGER IF NOT EXISTS cache_added AFTER INSERT ON cache '
+                       'BEGIN UPDATE cache_total SET bytes = bytes + new.size; END')
+            db.execute('CREATE TRIGGER IF NOT EXISTS cache_replaced AFTER UPDATE OF size ON cache '
+                       'BEGIN UPDATE cache_total SET bytes = bytes + new.size - old.size; END')
+            db.execute('CREATE TRIGGER IF NOT EXISTS cache_removed AFTER DELETE ON cache '
+                       'BEGIN UPDATE cache_total SET bytes = bytes - old.size; END')
+            db.execute('COMMIT')
+            self._connections.db, self._connections.pid = db, os.getpid()
+        return db
+
+
+class WarmStore:
+    """Read-only file of pickled results by cache key, memory-mapped.
+
+    The file holds the pickles back to back followed by a JSON index of
+    ``key: [offset, length]`` and, in its last eight bytes, the offset of
+    that index. Every worker maps the same file, so a host holds one copy
+    in its page cache. The file is looked for again every ``recheck``
+    seconds, so a store written after startup, or rewritten after a data
+    refresh, is picked up without a restart.
+    """
+
+    MAGIC = b'DASHWARM1\n'
+
+    def __init__(self, path, recheck=5.0):
+        self.path = str(path)
+        self.recheck = recheck
+        self._lock = threading.Lock()
+        # The index and the mapping it points into are swapped together.
+        self._view = {}, None
+        self._stamp = None
+        self._checked = None
+
+    def __len__(self):
+        self._refresh()
+        return len(self._view[0])
+
+    def lookup(self, func, *args):
+        """``(found, value)`` of the memoized ``func`` for ``args``, without calling it on a miss.
+
+        The miss is not counted; calling ``func`` after it counts it.
+        """
+        if not self.enabled:
+            return False, None
+        return self.get(self.key(func.__name__, args), count_miss=False)
+
+    def get(self, key, count_miss=True):
+        self._refresh()
+        index, mapped = self._view
+        entry = index.get(key)
+        if entry is None:
+            return False, None
+        offset, length = entry
+        return True, pickle.loads(mapped[offset:offset + length])
+
+    @classmethod
+    def write(cls, path, items):
+        """Write ``(key, pickled value)`` pairs to a new store at ``path``."""
+        path = str(path)
+        tmp = '%s.%s.tmp' % (path, uuid.uuid4().hex[:8])
+        index = {}
+        with open(tmp, 'wb') as f:
+            f.write(cls.MAGIC)
+            for key, blob in items:
+                index[key] = [f.tell(), len(blob)]
+                f.write(blob)
+            start = f.tell()
+            f.write(json.dumps(index).encode())
+            f.write(struct.pack('<Q', start))
+        os.replace(tmp, path)
+        return len(index)
+
+    def _refresh(self):
+        now = time.monotonic()
+        if self._checked is not None and now - self._checked < self.recheck:
+            return
+        with self._lock:
+            self._checked = now
+            try:
+                stat = os.stat(self.path)
+            except OSError:
+                self._view, self._stamp = ({}, None), None
+                return
+            stamp = stat.st_ino, stat.st_mtime_ns, stat.st_size
+            if stamp == self._stamp:
+                return
+            with open(self.path, 'rb') as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            if mapped[:len(self.MAGIC)] != self.MAGIC:
+                return
+            start, = struct.unpack('<Q', mapped[-8:])
+            self._view, self._stamp = (json.loads(mapped[start:-8]), mapped), stamp
+
+
+memoize = Memoizer()
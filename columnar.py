@@ -0,0 +1,258 @@
+import contextlib
+import fcntl
+import hashlib
+import io
+import json
+import os
+import pathlib
+import shutil
+import uuid
+
+import numpy as np
+
+
+# How much of the CSV before the ingested offset is hashed to tell an
+# append from a rewrite.
+TAIL_BYTES = 4096
+
+
+def load_columns(csv_path, store_dir=None, drop_dir=None):
+    """Load ``csv_path`` through its columnar store, re-ingesting when stale.
+
+    Each column is kept as a ``.npy`` file next to a ``meta.json`` recording
+    the CSV it came from and a generation token; string columns are stored
+    as integer codes plus their categories. Columns are memory-mapped, so
+    every worker on a host shares the same page cache instead of parsing
+    the CSV, and loading them needs numpy only.
+
+    Rows appended to the CSV since, or dropped into ``drop_dir``, are kept
+    as segments on top of these columns; see ``sync`` and ``load_segments``.
+
+    Returns ``(columns, categories, version)``: arrays by column name in
+    file order, the labels of each coded column and the token.
+    """
+    store_dir = pathlib.Path(store_dir or default_store_dir(csv_path))
+    meta = sync(csv_path, store_dir, drop_dir)
+
+    columns = {column['name']: np.load(store_dir / column['file'], mmap_mode='r') for column in meta['columns']}
+    return columns, _categories(meta), meta['token']
+
+
+def load_segments(csv_path, version, since=0, store_dir=None):
+    """Segments after the first ``since`` of the store, as ``(token, columns, categories)``.
+
+    ``categories`` are the labels of the whole store, which every
+    segment's codes index into. Returns None when the store is no longer
+    at ``version``, the token ``load_columns`` returned.
+    """
+    store_dir = pathlib.Path(store_dir or default_store_dir(csv_path))
+    meta = _read_meta(store_dir)
+    if meta is None or meta['token'] != version:
+        return None
+    return [(segment['token'],
+             {name: np.load(store_dir / file, mmap_mode='r') for name, file in segment['files'].items()},
+             _categories(meta))
+            for segment in meta['segments'][since:]]
+
+
+def sync(csv_path, store_dir=None, drop_dir=None):
+    """Bring the store up to date with ``csv_path`` and ``drop_dir``; returns its meta.
+
+    Rows appended to the CSV and CSV files new in ``drop_dir`` are ingested
+    as segments, at a cost proportional to the new rows. A CSV that was
+    rewritten rather than appended to, or a dropped file replaced since it
+    was ingested, makes everything be ingested again from scratch, under a
+    new token. Workers sharing a store take turns through a file lock.
+    """
+    csv_path = pathlib.Path(csv_path)
+    store_dir = pathlib.Path(store_dir or default_store_dir(csv_path))
+    store_dir.mkdir(parents=True, exist_ok=True)
+
+    with _locked(store_dir):
+        meta = _read_meta(store_dir)
+        changed = False
+        if meta is None or 'segments' not in meta:
+            meta = ingest(csv_path, store_dir)
+        elif meta['source'] != _fingerprint(csv_path):
+            # Taken before reading, so rows appended meanwhile are seen next time.
+            fingerprint = _fingerprint(csv_path)
+            start, data = _read_tail(csv_path, meta['offset'])
+            if data is not None and _tail(data, meta['offset'] - start) == meta['tail']:
+                # Only whole lines; the rest is picked up once it is finished.
+                end = data.rfind(b'\n') + 1
+                if end > meta['offset'] - start:
+                    _add_segment(meta, store_dir, data[meta['offset'] - start:end], 'csv')
+                    meta['offset'], meta['tail'] = start + end, _tail(data, end)
+                meta['source'] = fingerprint
+                changed = True
+            else:
+                meta = ingest(csv_path, store_dir)
+
+        if drop_dir is not None:
+            paths = sorted(pathlib.Path(drop_dir).glob('*.csv'))
+            if any(path.name in meta['drops'] and _fingerprint(path) != meta['drops'][path.name]
+                   for path in paths):
+                # The rows of a replaced file cannot be taken back out of
+                # the segments, so everything is ingested again.
+                meta = ingest(csv_path, store_dir)
+            for path in paths:
+                if path.name not in meta['drops']:
+                    fingerprint = _fingerprint(path)
+                    _add_segment(meta, store_dir, path.read_bytes(), path.name, header=True)
+                    meta['drops'][path.name] = fingerprint
+                    changed = True
+
+        if changed:
+            _write_meta(store_dir, meta)
+        return meta
+
+
+def default_store_dir(csv_path):
+    """Where the columnar store of ``csv_path`` and files derived from it live."""
+    csv_path = pathlib.Path(csv_path)
+    return csv_path.parent / '.columnar' / csv_path.stem
+
+
+def ingest(csv_path, store_dir):
+    """Convert ``csv_path`` into a columnar store under ``store_dir``."""
+    import pandas as pd
+
+    fingerprint = _fingerprint(csv_path)
+    with open(csv_path, 'rb') as f:
+        data = f.read()
+    frame = pd.read_csv(io.BytesIO(data))
+    store_dir.mkdir(parents=True, exist_ok=True)
+    token = uuid.uuid4().hex[:12]
+
+    columns = []
+    for name in frame.columns:
+        column = {'name': name, 'file': '%s.%s.npy' % (token, name)}
+        values = frame[name]
+        if not pd.api.types.is_numeric_dtype(values):
+            categories, codes = np.unique(values.astype(str), return_inverse=True)
+            column['categories'] = categories.tolist()
+            values = codes.astype(_code_dtype(len(categories)))
+        elif name == 'year':
+            values = values.to_numpy(dtype=np.int16)
+        elif values.dtype.kind == 'f' and np.array_equal(values, values.round()):
+            values = values.to_numpy(dtype=np.int64)
+        else:
+            values = values.to_numpy()
+        column['dtype'] = values.dtype.str
+        _atomic_write(store_dir / column['file'], lambda f, values=values: np.save(f, values))
+        columns.append(column)
+
+    # A last line without a newline may still be being written; a later
+    # append then cannot be told apart from it, so it forces a rewrite.
+    offset = len(data) if data.endswith(b'\n') else None
+    meta = {'source': fingerprint, 'token': token, 'columns': columns,
+            'offset': offset, 'tail': _tail(data, offset) if offset is not None else None,
+            'segments': [], 'drops': {}}
+    _write_meta(store_dir, meta)
+
+    # Workers that mapped or opened an older generation keep their handles.
+    for path in store_dir.iterdir():
+        if path.suffix in ('.npy', '.sqlite', '.warm', '.cube') and not path.name.startswith(token):
+            if path.is_dir():
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                path.unlink()
+    return meta
+
+
+def _add_segment(meta, store_dir, data, origin, header=False):
+    """Ingest the CSV rows in ``data`` as a new segment of ``meta``.
+
+    Without a ``header`` the columns are taken to be in the order of the
+    source CSV.
+    """
+    import pandas as pd
+
+    names = [column['name'] for column in meta['columns']]
+    if not data.strip():
+        return
+    if header:
+        frame = pd.read_csv(io.BytesIO(data))[names]
+    else:
+        frame = pd.read_csv(io.BytesIO(data), header=None, names=names)
+    if not len(frame):
+        return
+    token = uuid.uuid4().hex[:12]
+    segment = {'token': token, 'origin': origin, 'rows': len(frame), 'files': {}}
+    for column in meta['columns']:
+        name = column['name']
+        if 'categories' in column:
+            labels = frame[name].astype(str)
+            known = set(column['categories'])
+            column['categories'] += [label for label in pd.unique(labels) if label not in known]
+            values = pd.Categorical(labels, categories=column['categories']).codes.astype(
+                _code_dtype(len(column['categories'])))
+        else:
+            values = frame[name].to_numpy()
+            dtype = np.dtype(column['dtype'])
+            if dtype.kind in 'iu' and not np.array_equal(values, np.round(values)):
+                dtype = np.dtype(float)
+            values = values.astype(dtype)
+        segment['files'][name] = '%s.%s.npy' % (token, name)
+        _atomic_write(store_dir / segment['files'][name], lambda f, values=values: np.save(f, values))
+    meta['segments'].append(segment)
+
+
+def _read_tail(csv_path, offset):
+    """``(start, data)`` of ``csv_path`` from ``TAIL_BYTES`` before ``offset`` on.
+
+    ``data`` is None when the file no longer reaches ``offset``.
+    """
+    if offset is None:
+        return 0, None
+    start = max(0, offset - TAIL_BYTES)
+    with open(csv_path, 'rb') as f:
+        f.seek(start)
+        data = f.read()
+    return start, data if start + len(data) >= offset else None
+
+
+def _tail(data, offset):
+    return hashlib.md5(data[max(0, offset - TAIL_BYTES):offset]).hexdigest()
+
+
+def _categories(meta):
+    return {column['name']: column['categories'] for column in meta['columns'] if 'categories' in column}
+
+
+def _code_dtype(count):
+    return np.int16 if count < 2 ** 15 else np.int32
+
+
+@contextlib.contextmanager
+def _locked(store_dir):
+    with open(store_dir / '.lock', 'w') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _fingerprint(csv_path):
+    stat = os.stat(csv_path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def _read_meta(store_dir):
+    try:
+        with open(store_dir / 'meta.json') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_meta(store_dir, meta):
+    _atomic_write(store_dir / 'meta.json', lambda f: f.write(json.dumps(meta).encode()))
+
+
+def _atomic_write(path, write):
+    tmp = path.with_name('.%s.%s' % (path.name, uuid.uuid4().hex[:8]))
+    with open(tmp, 'wb') as f:
+        write(f)
+    os.replace(tmp, path)
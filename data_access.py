@@ -0,0 +1,1130 @@
+import bisect
+import contextlib
+import copy
+import json
+import os
+import pathlib
+import shutil
+import sqlite3
+import threading
+import uuid
+
+import numpy as np
+
+from columnar import default_store_dir, load_columns, load_segments, sync
+
+
+METRICS = ['pop', 'lifeExp', 'gdpPercap']
+
+# Observations the rolling average of a metric covers.
+ROLLING = 3
+
+# Columns computed from the metrics for every row; see ``derive``.
+DERIVED = [metric + suffix for suffix in ('_growth', '_avg', '_rank', '_pct') for metric in METRICS]
+
+# Significant digits a float32 derived column holds, and is written out with.
+FLOAT32_DIGITS = 7
+
+# What ``series`` returns for each country next to the year.
+SERIES = METRICS + DERIVED
+
+
+def open_cube(csv_path, backend='memory', drop_dir=None):
+    """Cube over ``csv_path`` answering the dashboard's queries.
+
+    ``memory`` maps a ``DataCube`` written next to the columnar store;
+    ``sqlite`` opens a ``SQLiteCube`` built there, for panels that do not
+    fit in each worker's memory. Either is built by the first process that
+    needs it. Rows appended to the CSV or dropped into ``drop_dir`` since
+    the store was built are added on top.
+    """
+    columns, categories, version = load_columns(csv_path, drop_dir=drop_dir)
+    segments = load_segments(csv_path, version)
+    if segments is None:
+        # Ingested again from scratch in the meantime.
+        return open_cube(csv_path, backend, drop_dir)
+
+    store_dir = default_store_dir(csv_path)
+    if backend == 'memory':
+        try:
+            return _open_data_cube(store_dir, version, columns, categories, segments)
+        except FileNotFoundError:
+            # Replaced meanwhile by a cube holding more segments.
+            return open_cube(csv_path, backend, drop_dir)
+    if backend == 'sqlite':
+        path = store_dir / ('%s.v%d.sqlite' % (version, SQLiteCube.SCHEMA))
+        if not path.exists():
+            SQLiteCube.build(path, columns, categories)
+        cube = SQLiteCube(path, version)
+        # The file holds the segments an earlier process applied already.
+        segments = segments[cube.segments:]
+        return cube.append(segments) if segments else cube
+    raise ValueError('unknown data backend %r' % backend)
+
+
+def _open_data_cube(store_dir, version, columns, categories, segments):
+    """The ``DataCube`` of ``version`` with ``segments`` added, mapped from ``store_dir``.
+
+    Starts from the cube written with the most of those segments, or builds
+    one with none. If that lacks some, they are added and the result is
+    written for the next process to map as it is.
+    """
+    written = {int(path.name.split('.')[1][1:]): path
+               for path in store_dir.glob('%s.s*.v%d.cube' % (version, DataCube.SCHEMA))}
+    held = max([count for count in written if count <= len(segments)], default=None)
+    if held is None:
+        held = 0
+        written[held] = _cube_path(store_dir, version, held)
+        DataCube.build(written[held], columns, categories)
+    cube = DataCube(written[held], version)
+    if held < len(segments):
+        path = _cube_path(store_dir, version, len(segments))
+        cube.append(segments[held:]).save(path)
+        cube = DataCube(path, version)
+        for count, stale in written.items():
+            if count < len(segments):
+                shutil.rmtree(stale, ignore_errors=True)
+    return cube
+
+
+def _cube_path(store_dir, version, segments):
+    return store_dir / ('%s.s%d.v%d.cube' % (version, segments, DataCube.SCHEMA))
+
+
+def refresh_cube(cube, csv_path, backend='memory', drop_dir=None):
+    """``cube`` with the rows appended to ``csv_path`` or dropped into ``drop_dir`` since.
+
+    Returns None when there are none. Appended rows cost in proportion to
+    their number; a CSV that was rewritten rather than appended to is
+    opened afresh.
+    """
+    meta = sync(csv_path, drop_dir=drop_dir)
+    if meta['token'] == cube.version:
+        segments = load_segments(csv_path, cube.version, cube.segments)
+        if segments == []:
+            return None
+        if segments is not None:
+            return cube.append(segments)
+    return open_cube(csv_path, backend, drop_dir)
+
+
+class DataCube:
+    """Country/year aggregate of the gapminder columns, built once per data version.
+
+    Rows are sorted by continent, country and year and kept as one block of
+    columns per continent, in which every country occupies a contiguous
+    run; the callbacks look up a country's run by its offset in the block
+    and narrow it to a year window with a binary search.
+
+    ``build`` sums and sorts the plain arrays ``columnar.load_columns``
+    returns, derives the ``DERIVED`` columns and the top-N indexes, and
+    writes it all to a directory of ``.npy`` files. The cube maps that
+    directory, so a worker starts without sorting or summing anything and
+    every worker on a host shares the same pages; pandas is never
+    imported. ``append`` returns a new cube with more rows, leaving this
+    one intact for the callbacks still reading it; the blocks of continents
+    the rows do not fall into are shared.
+    """
+
+    KEYS = ['continent', 'country', 'year']
+
+    # Part of the directory name, so a cube of an older layout is built again.
+    SCHEMA = 1
+
+    def __init__(self, path, version=''):
+        path = pathlib.Path(path)
+        with open(path / 'meta.json') as f:
+            meta = json.load(f)
+        self.version = version
+        self.names = meta['names']
+        self.years = meta['years']
+        self.continents = meta['continents']
+        # Appended segments included, and the last one touching each
+        # continent and (continent, country); see ``generation``.
+        self.segments = meta['segments']
+        self._generations = {(continent, country) if country else continent: segment
+                             for continent, country, segment in meta['generations']}
+        self._set_labels(meta['categories'])
+
+        columns = {name: np.load(path / ('%s.npy' % name), mmap_mode='r') for name in self.names}
+        self._dtypes = {name: values.dtype for name, values in columns.items()}
+        self._rows = len(columns['year'])
+        starts = np.load(path / 'starts.npy')
+        best, score = np.load(path / 'top_best.npy'), np.load(path / 'top_score.npy')
+
+        # By continent: its columns, its countries in order, their position
+        # in that order, the row each starts at (and where the last ends),
+        # and the top-N index of each metric.
+        self._columns, self._countries, self._ordinal, self._starts, self._top = {}, {}, {}, {}, {}
+        for i, (continent, lo, hi, first, last) in enumerate(meta['blocks']):
+            self._columns[continent] = {name: values[lo:hi] for name, values in columns.items()}
+            self._set_countries(continent, self._decode('country', columns['country'][starts[first:last]]).tolist(),
+                                starts[first:last + 1] - lo)
+            for j, metric in enumerate(METRICS):
+                self._top[continent, metric] = RangeMaxIndex.from_winners(best[i, j], score[i, j])
+
+    @classmethod
+    def build(cls, path, columns, categories):
+        """Sum, sort and derive ``columns`` and write the cube to the directory ``path``."""
+        cube = cls.__new__(cls)
+        cube.version, cube.segments, cube._generations = '', 0, {}
+        cube._set_labels(categories)
+        aggregated = _aggregate(columns, cube._label_rank)
+        aggregated.update(derive(aggregated['continent'], aggregated['country'], aggregated['year'],
+                                 {metric: aggregated[metric] for metric in METRICS}))
+        cube.names = list(aggregated)
+        cube._dtypes = {name: values.dtype for name, values in aggregated.items()}
+        cube.years = np.unique(aggregated['year']).tolist()
+        cube.continents = cube._first_seen(columns['continent'])
+        cube._rows = len(aggregated['year'])
+
+        cube._columns, cube._countries, cube._ordinal, cube._starts, cube._top = {}, {}, {}, {}, {}
+        bounds = _run_starts(aggregated['continent']).tolist()
+        for lo, hi in zip(bounds[:-1], bounds[1:]):
+            block = {name: values[lo:hi] for name, values in aggregated.items()}
+            continent = cube._decode('continent', block['continent'][:1])[0]
+            starts = _run_starts(block['country'])
+            cube._columns[continent] = block
+            cube._set_countries(continent, cube._decode('country', block['country'][starts[:-1]]).tolist(), starts)
+            cube._index(continent)
+        cube.save(path)
+
+    def save(self, path):
+        """Write the cube to the new directory ``path``, for ``DataCube(path)`` to map.
+
+        The files are written under a temporary name that is then renamed;
+        if another process got there first, its directory is kept.
+        """
+        path = pathlib.Path(path)
+        tmp = path.with_name('.%s.%s' % (path.name, uuid.uuid4().hex[:8]))
+        tmp.mkdir()
+        continents = sorted(self._columns)
+        blocks, starts, lo, first = [], [], 0, 0
+        for continent in continents:
+            hi, last = lo + len(self._columns[continent]['year']), first + len(self._countries[continent])
+            blocks.append([continent, lo, hi, first, last])
+            starts.append(self._starts[continent][:-1] + lo)
+            lo, first = hi, last
+        np.save(tmp / 'starts.npy', np.concatenate(starts + [[lo]]).astype(np.int64))
+        for name in self.names:
+            np.save(tmp / ('%s.npy' % name), np.concatenate(
+                [self._columns[continent][name] for continent in continents] or [np.zeros(0, self._dtypes[name])]))
+        shape = len(continents), len(METRICS), len(self.years)
+        np.save(tmp / 'top_best.npy', np.array([[self._top[continent, metric].best[0] for metric in METRICS]
+                                                for continent in continents], dtype=np.int64).reshape(shape))
+        np.save(tmp / 'top_score.npy', np.array([[self._top[continent, metric].score[0] for metric in METRICS]
+                                                 for continent in continents], dtype=float).reshape(shape))
+
+        meta = {
+            'names': self.names,
+            'years': self.years,
+            'continents': self.continents,
+            'segments': self.segments,
+            'generations': [[key, '', segment] if isinstance(key, str) else [key[0], key[1], segment]
+                            for key, segment in self._generations.items()],
+            'categories': {name: labels.tolist() for name, labels in self._labels.items()},
+            'blocks': blocks,
+        }
+        with open(tmp / 'meta.json', 'w') as f:
+            json.dump(meta, f)
+        try:
+            os.rename(tmp, path)
+        except OSError:
+            shutil.rmtree(tmp)
+
+    def _set_labels(self, categories):
+        self._labels = {name: np.array(labels, dtype=object) for name, labels in categories.items()}
+        self._label_rank = {name: _ranks(labels) for name, labels in self._labels.items()}
+
+    def _set_countries(self, continent, countries, starts):
+        self._countries[continent] = countries
+        self._ordinal[continent] = {country: i for i, country in enumerate(countries)}
+        self._starts[continent] = starts
+
+    def _first_seen(self, continent):
+        continent = np.asarray(continent)
+        first_seen = np.unique(continent, return_index=True)[1]
+        return self._decode('continent', continent[np.sort(first_seen)]).tolist()
+
+    def _index(self, continent):
+        """Build the top-N indexes of ``continent``; rows are relative to its block."""
+        block = self._columns[continent]
+        rows = np.arange(len(block['year']))
+        positions = np.searchsorted(self.years, block['year'])
+        for metric in METRICS:
+            self._top[continent, metric] = RangeMaxIndex(rows, positions, block[metric].astype(float),
+                                                         len(self.years))
+
+    def append(self, segments):
+        """A new cube with the rows of ``segments`` added, as ``columnar.load_segments`` returns them.
+
+        Only the new rows are sorted and summed. They are then added to the
+        rows with the same key or spliced in between, which copies the
+        blocks of the continents they fall into and nothing else; the
+        offsets of the countries after them are shifted and the top-N
+        indexes updated with the rows that changed.
+        """
+        cube = self
+        for token, columns, categories in segments:
+            cube = cube._append(columns, categories)
+        return cube
+
+    def _append(self, columns, categories):
+        cube = copy.copy(self)
+        cube.segments = self.segments + 1
+        if any(len(labels) != len(self._labels.get(name, ())) for name, labels in categories.items()):
+            cube._set_labels(categories)
+        added = _aggregate(columns, cube._label_rank)
+        cube._generations = dict(self._generations)
+        cube._columns, cube._countries, cube._ordinal, cube._starts, cube._top = (
+            dict(self._columns), dict(self._countries), dict(self._ordinal), dict(self._starts), dict(self._top))
+
+        # A column the new rows no longer fit changes type in every block.
+        cube._dtypes = {name: np.result_type(dtype, added[name]) if name in added else dtype
+                        for name, dtype in self._dtypes.items()}
+        promoted = [name for name in cube._dtypes if cube._dtypes[name] != self._dtypes[name]]
+        if promoted:
+            cube._columns = {continent: dict(block, **{name: block[name].astype(cube._dtypes[name])
+                                                       for name in promoted})
+                             for continent, block in cube._columns.items()}
+
+        cube.years = sorted(set(self.years).union(np.unique(added['year']).tolist()))
+        if cube.years != self.years:
+            moved = np.searchsorted(cube.years, self.years)
+            cube._top = {key: index.spread(moved, len(cube.years)) for key, index in cube._top.items()}
+
+        bounds = _block_index(cube._decode('continent', added['continent']))
+        for continent, (lo, hi) in bounds.items():
+            cube._splice(continent, {name: values[lo:hi] for name, values in added.items()})
+        cube.continents = self.continents + [continent for continent in cube._first_seen(columns['continent'])
+                                             if continent not in self.continents]
+        cube._rows = sum(len(block['year']) for block in cube._columns.values())
+        return cube
+
+    def _splice(self, continent, added):
+        """Add the aggregated rows ``added``, all of ``continent``, to its block."""
+        block = self._columns.get(continent) or {name: np.zeros(0, dtype=dtype)
+                                                 for name, dtype in self._dtypes.items()}
+        countries = self._countries.get(continent, [])
+        ordinal = self._ordinal.get(continent, {})
+        starts = self._starts.get(continent, np.zeros(1, dtype=np.int64))
+        year = block['year']
+
+        # Rows of the block to add to, and rows to insert before, with the
+        # rows of ``added`` that go there; countries the block lacks are
+        # inserted at the start of the one they come before.
+        summed, summed_from, inserted, inserted_from = [], [], [], []
+        grown = np.zeros(len(countries), dtype=np.int64)
+        new, new_at, new_sizes = [], [], []
+        touched = _block_index(self._decode('country', added['country']))
+        for country, (lo, hi) in touched.items():
+            i = ordinal.get(country)
+            if i is None:
+                at = bisect.bisect(countries, country)
+                start = stop = starts[at]
+                new.append(country)
+                new_at.append(at)
+                new_sizes.append(hi - lo)
+            else:
+                start, stop = starts[i], starts[i + 1]
+            years = added['year'][lo:hi]
+            at = start + np.searchsorted(year[start:stop], years)
+            found = at < stop
+            found[found] = year[at[found]] == years[found]
+            summed.append(at[found])
+            summed_from.append(lo + np.flatnonzero(found))
+            inserted.append(at[~found])
+            inserted_from.append(lo + np.flatnonzero(~found))
+            if i is not None:
+                grown[i] = np.count_nonzero(~found)
+        summed, summed_from, inserted, inserted_from = (
+            np.concatenate(parts) if parts else np.zeros(0, dtype=np.int64)
+            for parts in (summed, summed_from, inserted, inserted_from))
+
+        # Where a row of the block ends up once ``inserted`` are in, as np.insert places them.
+        summed = summed + np.searchsorted(inserted, summed, side='right')
+        columns = {}
+        for name, values in block.items():
+            extra = added[name] if name in added else np.zeros(len(added['year']), dtype=values.dtype)
+            columns[name] = np.insert(values, inserted, extra[inserted_from])
+            if name in METRICS:
+                columns[name][summed] += extra[summed_from]
+
+        sizes = np.diff(starts) + grown
+        if new:
+            sizes = np.insert(sizes, new_at, new_sizes)
+            countries = np.insert(np.array(countries, dtype=object), new_at, new).tolist()
+        starts = np.concatenate([[0], np.cumsum(sizes)])
+        if new:
+            self._set_countries(continent, countries, starts)
+        else:
+            self._starts[continent] = starts
+        self._columns[continent] = columns
+
+        # Growth and averages change only along the touched countries, and
+        # ranks and percentiles only within the years the rows are in.
+        rows, offsets = _gather([(starts[self._ordinal[continent][country]],
+                                  starts[self._ordinal[continent][country] + 1]) for country in touched])
+        first = np.zeros(len(rows), dtype=bool)
+        first[offsets[:-1]] = True
+        for name, values in _trends(first, {metric: columns[metric][rows] for metric in METRICS}).items():
+            columns[name][rows] = values
+        rows = np.flatnonzero(np.isin(columns['year'], added['year']))
+        for name, values in _standings(np.zeros(len(rows), dtype=np.int8), columns['year'][rows],
+                                       {metric: columns[metric][rows] for metric in METRICS}).items():
+            columns[name][rows] = values
+
+        # Rows added to can only have gone up, so only they and the
+        # inserted rows can take over the top of their year; otherwise the
+        # index is built again.
+        changed = np.concatenate([summed, inserted + np.arange(len(inserted))])
+        positions = np.searchsorted(self.years, columns['year'][changed])
+        for metric in METRICS:
+            index = self._top.get((continent, metric))
+            if index is None or np.any(added[metric][summed_from] < 0):
+                rows = np.arange(len(columns['year']))
+                self._top[continent, metric] = RangeMaxIndex(
+                    rows, np.searchsorted(self.years, columns['year']), columns[metric].astype(float), len(self.years))
+            else:
+                self._top[continent, metric] = index.shifted(inserted).raised(
+                    changed, positions, columns[metric][changed].astype(float))
+
+        for country in touched:
+            self._generations[continent] = self._generations[continent, country] = self.segments
+
+    def generation(self, continent, countries=None):
+        """Last appended segment touching ``continent``, or only its ``countries``; 0 for none.
+
+        Results computed from those rows alone stay valid while it is unchanged.
+        """
+        if countries is None:
+            return self._generations.get(continent, 0)
+        return max([self._generations.get((continent, country), 0) for country in countries], default=0)
+
+    def __len__(self):
+        return self._rows
+
+    def _block(self, continent):
+        block = self._columns.get(continent)
+        if block is None:
+            block = {name: np.zeros(0, dtype=dtype) for name, dtype in self._dtypes.items()}
+        return block
+
+    def records(self, continent, rows):
+        """``rows`` of ``continent`` as a list of ``{column: value}`` dicts of plain Python values."""
+        block = self._block(continent)
+        columns = [self._decode(name, block[name][rows]).tolist() for name in self.names]
+        return [dict(zip(self.names, values)) for values in zip(*columns)]
+
+    def _decode(self, name, values):
+        return self._labels[name][values] if name in self._labels else _plain(values)
+
+    def _sort_key(self, name, values):
+        return _sort_key(values, self._label_rank.get(name))
+
+    def countries(self, continent):
+        return self._countries.get(continent, [])
+
+    def top(self, continent, metric, years):
+        """Row with the largest ``metric`` in ``continent`` over ``years``, or None."""
+        index = self._top.get((continent, metric))
+        if index is None:
+            return None
+        row = index.query(int(np.searchsorted(self.years, years[0], side='left')),
+                          int(np.searchsorted(self.years, years[1], side='right')) - 1)
+        return self.records(continent, [row])[0] if row >= 0 else None
+
+    def country_rows(self, continent, country, years=None):
+        """(start, stop) rows of ``country`` in the block of ``continent``, narrowed to ``years``."""
+        i = self._ordinal.get(continent, {}).get(country)
+        if i is None:
+            return 0, 0
+        starts = self._starts[continent]
+        lo, hi = int(starts[i]), int(starts[i + 1])
+        if years is not None:
+            block = self._columns[continent]['year'][lo:hi]
+            lo, hi = (lo + int(np.searchsorted(block, years[0], side='left')),
+                      lo + int(np.searchsorted(block, years[1], side='right')))
+        # An empty span, as SQLite's BETWEEN makes of reversed years.
+        return lo, max(lo, hi)
+
+    def count(self, continent, countries, years=None):
+        """Number of rows ``rows`` would return, without gathering them."""
+        return sum(hi - lo for lo, hi in (self.country_rows(continent, country, years) for country in countries))
+
+    def rows(self, continent, countries, years=None):
+        """Rows of ``countries`` within ``years`` in the block of ``continent``, one country after another.
+
+        Also returns the offsets at which each country's rows start, so
+        ``rows[offsets[i]:offsets[i + 1]]`` belongs to ``countries[i]``.
+        """
+        return _gather([self.country_rows(continent, country, years) for country in countries])
+
+    def series(self, continent, countries, years=None, points=None, window=None):
+        """Year and metric lists for each of ``countries``, gathered in one pass.
+
+        With ``points``, a series longer than that is cut down to about
+        ``points`` rows by ``minmax_positions``; a zoom ``window`` adds as
+        many rows again from inside it, so the zoomed span stays detailed
+        while the rest of the series is still there to pan to. The rows are
+        picked by the raw metrics and the ``SERIES`` columns derived from
+        them follow.
+        """
+        block = self._block(continent)
+        rows, offsets = self.rows(continent, countries, years)
+        if points:
+            rows, offsets = _level_of_detail(block, rows, offsets, points, window)
+        columns = dict({'year': block['year'][rows]}, **{name: self._decode(name, block[name][rows])
+                                                         for name in SERIES})
+        pieces = {name: np.split(values, offsets[1:-1]) for name, values in columns.items()}
+        return [dict({'country': country}, **{name: pieces[name][i].tolist() for name in columns})
+                for i, country in enumerate(countries)]
+
+    def table(self, continent, countries, years, sort_by, start, stop, progress=None):
+        """Records ``start:stop`` of the table of ``countries`` within ``years``, ordered by ``sort_by``.
+
+        ``progress`` is called with the fraction done between the steps of
+        the work, and may raise to abandon it.
+        """
+        progress = progress or _ignore
+        rows, _ = self.rows(continent, countries, years)
+        progress(0.1)
+        rows = self._order(continent, rows, sort_by, progress)
+        progress(0.9)
+        return self.records(continent, rows[start:stop])
+
+    def iter_table(self, continent, countries, years, sort_by, chunk_rows=65536):
+        """The rows ``table`` pages through, as ``{column: values}`` chunks of ``chunk_rows``.
+
+        Only the row positions of the whole result are held at once; values
+        are gathered one chunk at a time.
+        """
+        block = self._block(continent)
+        rows, _ = self.rows(continent, countries, years)
+        rows = self._order(continent, rows, sort_by)
+        for start in range(0, len(rows), chunk_rows):
+            chunk = rows[start:start + chunk_rows]
+            yield {name: self._decode(name, block[name][chunk]) for name in self.names}
+
+    def _order(self, continent, rows, sort_by, progress=None):
+        """``rows`` ordered by the DataTable ``sort_by`` list; ties keep cube order."""
+        progress = progress or _ignore
+        block = self._block(continent)
+        keys = []
+        for column in reversed(sort_by):
+            name = column['column_id']
+            if name in block:
+                key = self._sort_key(name, block[name][rows])
+                keys.append(-key if column['direction'] == 'desc' else key)
+                progress(0.1 + 0.4 * len(keys) / len(sort_by))
+        return rows[np.lexsort(keys)] if keys else rows
+
+
+def _aggregate(columns, ranks):
+    """The key and metric ``columns``, sorted by key and summed per key.
+
+    Coded columns sort by label, through the ``ranks`` of their codes.
+    """
+    keys = [_sort_key(np.asarray(columns[name]), ranks.get(name)) for name in DataCube.KEYS]
+    order = np.lexsort(keys[::-1])
+    starts = _run_starts(*(key[order] for key in keys))[:-1]
+
+    aggregated = {}
+    for name in columns:
+        if name not in DataCube.KEYS and name not in METRICS:
+            continue
+        values = np.asarray(columns[name])[order]
+        if name in METRICS:
+            values = np.add.reduceat(np.where(np.isnan(values), 0, values) if values.dtype.kind == 'f'
+                                     else values, starts) if len(starts) else values
+        else:
+            values = values[starts]
+        aggregated[name] = values
+    return aggregated
+
+
+def _ignore(progress=None):
+    pass
+
+
+def _sort_key(values, rank=None):
+    """``values`` as numbers that sort like them: codes by the ``rank`` of their label, NaN first."""
+    if rank is not None:
+        return rank[values]
+    if values.dtype.kind == 'f':
+        return np.where(np.isnan(values), -np.inf, values)
+    return values
+
+
+def _level_of_detail(block, rows, offsets, points, window):
+    kept = []
+    for start, stop in zip(offsets[:-1], offsets[1:]):
+        picked = rows[start:stop]
+        kept.append(picked[level_of_detail(block['year'][picked], {metric: block[metric][picked]
+                                                                   for metric in METRICS}, points, window)])
+    lengths = [len(picked) for picked in kept]
+    return (np.concatenate(kept) if kept else rows[:0],
+            np.concatenate([[0], np.cumsum(lengths, dtype=np.int64)]))
+
+
+def _plain(values):
+    """``values`` as they are handed out: float32 widened to float64 with only the digits it holds.
+
+    Otherwise a growth of 13.334935 would reach JSON and CSV as 13.334935188293457.
+    """
+    if values.dtype != np.float32:
+        return values
+    values = values.astype(float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        exponent = FLOAT32_DIGITS - 1 - np.floor(np.log10(np.abs(values)))
+    exponent = np.where(np.isfinite(exponent), exponent, 0)
+    scale = 10.0 ** np.abs(exponent)
+    with np.errstate(invalid='ignore', over='ignore'):
+        return np.where(exponent >= 0, np.round(values * scale) / scale, np.round(values / scale) * scale)
+
+
+def _gather(ranges):
+    """Rows of the (start, stop) ``ranges`` one after another, and the offset each starts at."""
+    ranges = np.array(ranges, dtype=np.int64).reshape(-1, 2)
+    lengths = ranges[:, 1] - ranges[:, 0]
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+    return np.arange(offsets[-1]) + np.repeat(ranges[:, 0] - offsets[:-1], lengths), offsets
+
+
+def derive(continent, country, year, values):
+    """``DERIVED`` columns of rows sorted by continent, country and year.
+
+    ``values`` holds the metric columns. Growth, the percent change since
+    the previous observation, and the rolling average of the last
+    ``ROLLING`` observations run along each country's years; rank (1 for
+    the largest) and percentile compare the countries of a continent in the
+    same year. Every row is computed at once from shifted arrays and one
+    sort per metric, and stored in a 32-bit type where that
+    holds the value.
+    """
+    first = np.ones(len(year), dtype=bool)
+    first[1:] = (continent[1:] != continent[:-1]) | (country[1:] != country[:-1])
+    derived = _trends(first, values)
+    derived.update(_standings(continent, year, values))
+    return {name: derived[name] for name in DERIVED if name in derived}
+
+
+def _trends(first, values):
+    """Growth and rolling average of the metric ``values`` along runs of rows, each starting where ``first`` is set."""
+    size = len(first)
+    positions = np.arange(size)
+    block_start = np.maximum.accumulate(np.where(first, positions, 0)) if size else positions
+
+    derived = {}
+    for metric, column in values.items():
+        column = np.asarray(column, dtype=float)
+        previous = np.roll(column, 1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            growth = 100 * (column - previous) / previous
+        growth[first | (previous == 0)] = np.nan
+        derived[metric + '_growth'] = growth.astype(np.float32)
+
+        # Summed one lag at a time rather than from running totals, which
+        # lose the precision of small values next to large ones.
+        present = ~np.isnan(column)
+        sums, counts = np.zeros(size), np.zeros(size)
+        for lag in range(ROLLING):
+            inside = positions - lag >= block_start
+            lagged = np.roll(column, lag)
+            sums += np.where(inside & np.roll(present, lag), lagged, 0)
+            counts += inside & np.roll(present, lag)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            derived[metric + '_avg'] = sums / counts
+    return derived
+
+
+def _standings(continent, year, values):
+    """Rank and percentile of the metric ``values`` among the rows of the same ``continent`` code and year."""
+    size = len(year)
+    positions = np.arange(size)
+
+    derived = {}
+    for metric, column in values.items():
+        column = np.asarray(column, dtype=float)
+        # Each continent and year together, largest first; ties share the
+        # better rank.
+        score = np.where(np.isnan(column), -np.inf, column)
+        order = np.lexsort((-score, year, continent))
+        group_first = np.ones(size, dtype=bool)
+        group_first[1:] = ((continent[order][1:] != continent[order][:-1]) |
+                           (year[order][1:] != year[order][:-1]))
+        run_first = group_first.copy()
+        run_first[1:] |= score[order][1:] != score[order][:-1]
+        group_start = np.maximum.accumulate(np.where(group_first, positions, 0)) if size else positions
+        run_start = np.maximum.accumulate(np.where(run_first, positions, 0)) if size else positions
+        group_id = np.cumsum(group_first) - 1
+        group_size = np.bincount(group_id)[group_id] if size else group_id
+
+        rank = np.empty(size, dtype=np.int32)
+        rank[order] = run_start - group_start + 1
+        percentile = np.empty(size, dtype=np.float32)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            percentile[order] = np.where(group_size > 1, 100 * (group_size - rank[order]) / (group_size - 1), 100)
+        derived[metric + '_rank'] = rank
+        derived[metric + '_pct'] = percentile
+    return derived
+
+
+def level_of_detail(year, values, points, window=None):
+    """Positions to keep of one series of ``year`` and ``values`` by metric.
+
+    Every metric keeps its own extremes, so the budget is shared out between
+    them and the positions they pick are merged.
+    """
+    if len(year) <= points:
+        return np.arange(len(year))
+    buckets = max(1, points // (2 * len(values)))
+    picks = [minmax_positions(column, buckets) for column in values.values()]
+    if window is not None:
+        lo, hi = np.searchsorted(year, window[0], side='left'), np.searchsorted(year, window[1], side='right')
+        picks += [lo + minmax_positions(column[lo:hi], buckets) for column in values.values()]
+    return np.unique(np.concatenate(picks))
+
+
+def minmax_positions(values, buckets):
+    """Positions of the smallest and largest of ``values`` in each of ``buckets`` runs.
+
+    Min/max bucketing keeps every peak and trough a line chart would show at
+    a resolution of ``buckets`` pixels, plus both ends of the series; NaN
+    is only picked for a run that has nothing else.
+    """
+    size = len(values)
+    if size <= 2 * buckets:
+        return np.arange(size)
+    bucket = np.arange(size) * buckets // size
+    starts = np.searchsorted(bucket, np.arange(buckets))
+    stops = np.append(starts[1:], size)
+    # NaN sorts last within its run, so skip past them for the maximum.
+    order = np.lexsort((values, bucket))
+    missing = np.add.reduceat(np.isnan(values).astype(np.int64), starts)
+    largest = np.maximum(stops - 1 - missing, starts)
+    return np.unique(np.concatenate([[0, size - 1], order[starts], order[largest]]))
+
+
+def _ranks(labels):
+    """Position of each label in sorted order."""
+    ranks = np.empty(len(labels), dtype=np.int64)
+    ranks[np.argsort(labels, kind='stable')] = np.arange(len(labels))
+    return ranks
+
+
+def _run_starts(*columns):
+    """Rows at which a run of equal keys in sorted ``columns`` starts, followed by the number of rows."""
+    size = len(columns[0])
+    changed = np.zeros(size, dtype=bool)
+    changed[:1] = True
+    for column in columns:
+        changed[1:] |= column[1:] != column[:-1]
+    return np.append(np.flatnonzero(changed), size)
+
+
+def _block_index(*columns):
+    """Map each run of equal keys in sorted ``columns`` to its (start, stop) rows."""
+    bounds = _run_starts(*columns).tolist()
+    index = {}
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        key = tuple(column[start] for column in columns)
+        index[key if len(key) > 1 else key[0]] = (start, stop)
+    return index
+
+
+class RangeMaxIndex:
+    """Sparse table answering "row with the largest value in a year window".
+
+    ``best[k][j]`` holds the winning row over the ``2 ** k`` year positions
+    starting at ``j``, so any window is covered by two overlapping entries.
+    Ties go to the earlier row, matching ``nlargest(1)`` on the cube order.
+    Everything follows from the winner of each single year, which is all
+    ``shifted``, ``spread`` and ``raised`` have to update.
+    """
+
+    def __init__(self, rows, positions, values, size):
+        values = np.where(np.isnan(values), -np.inf, values)
+        order = np.lexsort((rows, -values, positions))
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = positions[order][1:] != positions[order][:-1]
+        winners = order[first]
+
+        best = np.full(size, -1, dtype=np.int64)
+        score = np.full(size, -np.inf)
+        best[positions[winners]] = rows[winners]
+        score[positions[winners]] = values[winners]
+        self._build(best, score)
+
+    @classmethod
+    def from_winners(cls, best, score):
+        """Index over the winning row ``best`` and its ``score`` of each year position, -1 for none."""
+        index = cls.__new__(cls)
+        index._build(best, score)
+        return index
+
+    def _build(self, best, score):
+        self.best, self.score = [best], [score]
+        size, width = len(best), 1
+        while 2 * width <= size:
+            take_right = _beats(self.best[-1][width:], self.score[-1][width:],
+                                self.best[-1][:-width], self.score[-1][:-width])
+            self.best.append(np.where(take_right, self.best[-1][width:], self.best[-1][:-width]))
+            self.score.append(np.where(take_right, self.score[-1][width:], self.score[-1][:-width]))
+            width *= 2
+
+    def shifted(self, inserted):
+        """The index once rows are inserted before the rows ``inserted``, in order, as ``np.insert`` does."""
+        best = self.best[0]
+        return self.from_winners(np.where(best >= 0, best + np.searchsorted(inserted, best, side='right'), -1),
+                                 self.score[0])
+
+    def spread(self, positions, size):
+        """The index with year position ``i`` moved to ``positions[i]`` of ``size``."""
+        best, score = np.full(size, -1, dtype=np.int64), np.full(size, -np.inf)
+        best[positions], score[positions] = self.best[0], self.score[0]
+        return self.from_winners(best, score)
+
+    def raised(self, rows, positions, values):
+        """The index once ``rows`` at year ``positions`` hold ``values``, none of them lower than before."""
+        other = RangeMaxIndex(rows, positions, values, len(self.best[0]))
+        take = _beats(other.best[0], other.score[0], self.best[0], self.score[0])
+        return self.from_winners(np.where(take, other.best[0], self.best[0]),
+                                 np.where(take, other.score[0], self.score[0]))
+
+    def query(self, start, stop):
+        """Row of the maximum over positions ``start..stop`` inclusive, or -1."""
+        stop = min(stop, len(self.best[0]) - 1)
+        if stop < start:
+            return -1
+        k = (stop - start + 1).bit_length() - 1
+        left, right = start, stop - (1 << k) + 1
+        if _beats(self.best[k][right], self.score[k][right], self.best[k][left], self.score[k][left]):
+            return int(self.best[k][right])
+        return int(self.best[k][left])
+
+
+def _beats(row, score, other_row, other_score):
+    return (row >= 0) & ((score > other_score) | ((score == other_score) & ((other_row < 0) | (row < other_row))))
+
+
+class SQLiteCube:
+    """The queries of ``DataCube`` pushed down into a local SQLite file.
+
+    The aggregated rows are stored in cube order with a unique index on
+    (continent, country, year) for series, counts, table pages and appends,
+    and one on (continent, metric descending) per metric for the top-N
+    queries behind the KPIs. Only the rows a query returns are ever read into Python.
+
+    Every thread gets its own read-only connection, and each query uses a
+    fixed SQL text, so sqlite3 reuses the prepared statement per connection.
+    """
+
+    # Part of the file name, so a file of an older layout is built again.
+    SCHEMA = 3
+
+    def __init__(self, path, version=''):
+        self.path = str(path)
+        self.version = version
+        self._connections = threading.local()
+        meta = {key: json.loads(value) for key, value in self._db().execute('SELECT key, value FROM meta')}
+        self.names = meta['columns']
+        self.years = meta['years']
+        self.continents = meta['continents']
+        self._countries = meta['countries']
+        self._rows = meta['rows']
+        self.segments = meta.get('segments', 0)
+        self._generations = {(continent, country) if country else continent: segment
+                             for continent, country, segment in self._db().execute(
+                                 'SELECT continent, country, segment FROM generations')}
+
+    @classmethod
+    def build(cls, path, columns, categories, chunk_rows=10 ** 5):
+        """Write the aggregated ``columns`` to a new SQLite file at ``path``.
+
+        The rows are summed per key and their ``DERIVED`` columns computed
+        as for ``DataCube``, then inserted once, in key order, so rowid
+        order is cube order.
+        """
+        labels = {name: np.array(values, dtype=object) for name, values in categories.items()}
+        aggregated = _aggregate(columns, {name: _ranks(values) for name, values in labels.items()})
+        aggregated.update(derive(aggregated['continent'], aggregated['country'], aggregated['year'],
+                                 {metric: aggregated[metric] for metric in METRICS}))
+        names = list(aggregated)
+        types = {name: 'TEXT' if name in labels else 'INTEGER' if values.dtype.kind in 'iu' else 'REAL'
+                 for name, values in aggregated.items()}
+
+        tmp = path.with_name('.%s.%s' % (path.name, uuid.uuid4().hex[:8]))
+        db = sqlite3.connect(str(tmp), isolation_level=None)
+        db.execute('PRAGMA journal_mode=OFF')
+        db.execute('PRAGMA synchronous=OFF')
+        db.execute('BEGIN')
+        db.execute('CREATE TABLE cube (%s)' % ', '.join('"%s" %s' % (name, types[name]) for name in names))
+        _insert(db, 'cube', names, labels, aggregated, chunk_rows)
+        db.execute('CREATE UNIQUE INDEX cube_key ON cube (continent, country, year)')
+        # For the rows whose ranks an append changes.
+        db.execute('CREATE INDEX cube_year ON cube (continent, year)')
+        # Ties go to the first row in cube order, which appended rows do
+        # not keep to in rowid order.
+        for metric in METRICS:
+            db.execute('CREATE INDEX "cube_top_%s" ON cube (continent, "%s" DESC, country, year)' % (metric, metric))
+        db.execute('CREATE TABLE generations (continent TEXT, country TEXT, segment INTEGER, '
+                   'PRIMARY KEY (continent, country))')
+
+        raw_continent = np.asarray(columns['continent'])
+        first_seen = np.unique(raw_continent, return_index=True)[1]
+        countries = {}
+        for continent, country in db.execute('SELECT DISTINCT continent, country FROM cube '
+                                             'ORDER BY continent, country'):
+            countries.setdefault(continent, []).append(country)
+        meta = {
+            'columns': names,
+            'years': np.unique(aggregated['year']).tolist(),
+            'continents': labels['continent'][raw_continent[np.sort(first_seen)]].tolist(),
+            'countries': countries,
+            'rows': len(aggregated['year']),
+            'segments': 0,
+        }
+        db.execute('CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)')
+        db.executemany('INSERT INTO meta VALUES (?, ?)', [(key, json.dumps(value)) for key, value in meta.items()])
+        db.execute('COMMIT')
+        db.execute('ANALYZE')
+        db.close()
+        os.replace(tmp, path)
+
+    def append(self, segments, chunk_rows=10 ** 5):
+        """Add the rows of ``segments`` to the file and return a cube reading it.
+
+        Each segment is applied once, by whichever worker gets to it first;
+        the others find it applied and only read the new metadata.
+        """
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            db.execute('BEGIN IMMEDIATE')
+            meta = {key: json.loads(value) for key, value in db.execute('SELECT key, value FROM meta')}
+            for number, (token, columns, categories) in enumerate(segments, self.segments + 1):
+                if number > meta['segments']:
+                    self._apply(db, meta, number, columns, categories, chunk_rows)
+            db.executemany('INSERT OR REPLACE INTO meta VALUES (?, ?)',
+                           [(key, json.dumps(value)) for key, value in meta.items()])
+            db.execute('COMMIT')
+        finally:
+            db.close()
+        return SQLiteCube(self.path, self.version)
+
+    def _apply(self, db, meta, number, columns, categories, chunk_rows):
+        labels = {name: np.array(values, dtype=object) for name, values in categories.items()}
+        names = [name for name in self.names if name not in DERIVED]
+        quoted = ', '.join('"%s"' % name for name in names)
+        db.execute('CREATE TEMP TABLE raw AS SELECT %s FROM cube LIMIT 0' % quoted)
+        _insert(db, 'raw', names, labels, columns, chunk_rows)
+
+        new_rows, = db.execute('SELECT COUNT(*) FROM (SELECT DISTINCT continent, country, year FROM raw) AS added '
+                               'WHERE NOT EXISTS (SELECT 1 FROM cube WHERE cube.continent = added.continent '
+                               'AND cube.country = added.country AND cube.year = added.year)').fetchone()
+        # WHERE true keeps the upsert's ON CONFLICT from parsing as a join.
+        db.execute('INSERT INTO cube (%s) SELECT %s FROM raw WHERE true GROUP BY continent, country, year '
+                   'ON CONFLICT (continent, country, year) DO UPDATE SET %s' % (
+                       quoted, ', '.join('COALESCE(SUM("%s"), 0)' % name if name in METRICS else '"%s"' % name
+                                         for name in names),
+                       ', '.join('"%s" = "%s" + excluded."%s"' % (metric, metric, metric) for metric in METRICS
+                                 if metric in names)))
+        _derive(db)
+        db.execute("INSERT OR REPLACE INTO generations SELECT DISTINCT continent, '', ? FROM raw", (number,))
+        db.execute('INSERT OR REPLACE INTO generations SELECT DISTINCT continent, country, ? FROM raw', (number,))
+
+        for continent, country in db.execute('SELECT DISTINCT continent, country FROM raw').fetchall():
+            if continent not in meta['countries']:
+                meta['continents'].append(continent)
+            countries = meta['countries'].setdefault(continent, [])
+            if country not in countries:
+                bisect.insort(countries, country)
+        meta['years'] = sorted(set(meta['years']) | set(np.unique(np.asarray(columns['year'])).tolist()))
+        meta['rows'] += new_rows
+        meta['segments'] = number
+        db.execute('DROP TABLE raw')
+
+    def __len__(self):
+        return self._rows
+
+    def countries(self, continent):
+        return self._countries.get(continent, [])
+
+    generation = DataCube.generation
+
+    def top(self, continent, metric, years):
+        """Row with the largest ``metric`` in ``continent`` over ``years``, or None."""
+        if metric not in METRICS:
+            return None
+        # Walking the metric index from the top stops at the first row in
+        # the window; left to itself the planner scans the window and sorts.
+        row = self._db().execute('SELECT %s FROM cube INDEXED BY "cube_top_%s" '
+                                 'WHERE continent = ? AND year BETWEEN ? AND ? '
+                                 'ORDER BY "%s" DESC, country, year LIMIT 1' % (self._columns(), metric, metric),
+                                 (continent, years[0], years[1])).fetchone()
+        return dict(zip(self.names, row)) if row is not None else None
+
+    def count(self, continent, countries, years=None):
+        """Number of rows of ``countries`` within ``years``."""
+        db = self._db()
+        return sum(db.execute('SELECT COUNT(*) FROM cube WHERE continent = ? AND country = ? '
+                              'AND year BETWEEN ? AND ?', (continent, country) + self._span(years)).fetchone()[0]
+                   for country in countries)
+
+    def series(self, continent, countries, years=None, points=None, window=None):
+        """Year and ``SERIES`` lists for each of ``countries``, as ``DataCube.series``."""
+        db = self._db()
+        series = []
+        for country in countries:
+            rows = db.execute('SELECT year, %s FROM cube WHERE continent = ? AND country = ? '
+                              'AND year BETWEEN ? AND ? ORDER BY year' % ', '.join('"%s"' % name for name in SERIES),
+                              (continent, country) + self._span(years)).fetchall()
+            columns = [_array(values) for values in zip(*rows)] or [np.array([])] * (len(SERIES) + 1)
+            year, values = columns[0], dict(zip(SERIES, columns[1:]))
+            if points:
+                keep = level_of_detail(year, {metric: values[metric] for metric in METRICS}, points, window)
+                year, values = year[keep], {name: column[keep] for name, column in values.items()}
+            series.append(dict({'country': country, 'year': year.tolist()},
+                               **{name: column.tolist() for name, column in values.items()}))
+        return series
+
+    def table(self, continent, countries, years, sort_by, start, stop, progress=None):
+        """Records ``start:stop`` of the table of ``countries`` within ``years``, ordered by ``sort_by``.
+
+        Ties keep cube order: the countries as listed, then year. SQLite
+        calls ``progress(None)`` while it works, as ``_checkpoints`` says.
+        """
+        if not countries:
+            return []
+        sql, params = self._table_query(continent, countries, years, sort_by)
+        db = self._db()
+        with _checkpoints(db, progress):
+            rows = db.execute(sql + ' LIMIT ? OFFSET ?', params + [max(0, stop - start), start]).fetchall()
+        return [dict(zip(self.names, row)) for row in rows]
+
+    def iter_table(self, continent, countries, years, sort_by, chunk_rows=65536):
+        """The rows ``table`` pages through, as ``{column: values}`` chunks of ``chunk_rows``.
+
+        Rows are fetched from a cursor as the chunks are consumed.
+        """
+        if not countries:
+            return
+        cursor = self._db().cursor()
+        cursor.execute(*self._table_query(continent, countries, years, sort_by))
+        try:
+            while True:
+                rows = cursor.fetchmany(chunk_rows)
+                if not rows:
+                    break
+                yield dict(zip(self.names, zip(*rows)))
+        finally:
+            cursor.close()
+
+    def _table_query(self, continent, countries, years, sort_by):
+        order = ['"%s" %s' % (column['column_id'], 'DESC' if column['direction'] == 'desc' else 'ASC')
+                 for column in sort_by if column['column_id'] in self.names]
+        sql = ('WITH picked (country, position) AS (VALUES %s) '
+               'SELECT %s FROM cube JOIN picked USING (country) '
+               'WHERE continent = ? AND year BETWEEN ? AND ? '
+               'ORDER BY %s' % (', '.join(['(?, ?)'] * len(countries)),
+                                ', '.join('cube."%s"' % name for name in self.names),
+                                ', '.join(order + ['picked.position', 'year'])))
+        params = [value for position, country in enumerate(countries) for value in (country, position)]
+        return sql, params + [continent] + list(self._span(years))
+
+    def _columns(self):
+        return ', '.join('"%s"' % name for name in self.names)
+
+    def _span(self, years):
+        if years is None:
+            return (self.years[0], self.years[-1]) if self.years else (0, -1)
+        return years[0], years[1]
+
+    def _db(self):
+        db = getattr(self._connections, 'db', None)
+        if db is None or self._connections.pid != os.getpid():
+            db = sqlite3.connect('file:%s?mode=ro' % self.path, uri=True, check_same_thread=False,
+                                 cached_statements=256)
+            db.execute('PRAGMA query_only=ON')
+            db.execute('PRAGMA mmap_size=268435456')
+            self._connections.db, self._connections.pid = db, os.getpid()
+        return db
+
+
+@contextlib.contextmanager
+def _checkpoints(db, progress, steps=10 ** 6):
+    """Call ``progress(None)`` every ``steps`` SQLite instructions of the statements run inside.
+
+    An exception ``progress`` raises interrupts the statement, and is
+    raised in place of the error that SQLite then reports.
+    """
+    if progress is None:
+        yield
+        return
+    raised = []
+
+    def check():
+        try:
+            progress(None)
+        except Exception as error:
+            raised.append(error)
+            return 1
+        return 0
+
+    db.set_progress_handler(check, steps)
+    try:
+        yield
+    except sqlite3.OperationalError:
+        if raised:
+            raise raised[0]
+        raise
+    finally:
+        db.set_progress_handler(None, steps)
+
+
+def _derive(db):
+    """Bring the ``DERIVED`` columns of the ``cube`` table up to date with the rows in ``raw``.
+
+    Growth and averages change only along the countries of those rows, and
+    ranks and percentiles only within their continents' years, so only
+    those rows are read and written back.
+    """
+    # CROSS JOIN keeps SQLite from scanning the cube for the few keys in raw.
+    metrics = ', '.join('cube."%s"' % metric for metric in METRICS)
+    rows = db.execute('SELECT cube.rowid, cube.continent, cube.country, cube.year, %s '
+                      'FROM (SELECT DISTINCT continent, country FROM raw) AS touched CROSS JOIN cube '
+                      'ON cube.continent = touched.continent AND cube.country = touched.country '
+                      'ORDER BY cube.continent, cube.country, cube.year' % metrics).fetchall()
+    if rows:
+        rowid, continent, country, year, *values = (np.array(column) for column in zip(*rows))
+        first = np.ones(len(rows), dtype=bool)
+        first[1:] = (continent[1:] != continent[:-1]) | (country[1:] != country[:-1])
+        _update(db, rowid, _trends(first, {metric: _array(column) for metric, column in zip(METRICS, values)}))
+
+    rows = db.execute('SELECT cube.rowid, cube.continent, cube.year, %s '
+                      'FROM (SELECT DISTINCT continent, year FROM raw) AS touched CROSS JOIN cube '
+                      'ON cube.continent = touched.continent AND cube.year = touched.year' % metrics).fetchall()
+    if rows:
+        rowid, continent, year, *values = (np.array(column) for column in zip(*rows))
+        _update(db, rowid, _standings(np.unique(continent, return_inverse=True)[1], year,
+                                      {metric: _array(column) for metric, column in zip(METRICS, values)}))
+
+
+def _update(db, rowid, columns):
+    db.executemany('UPDATE cube SET %s WHERE rowid = ?' % ', '.join('"%s" = ?' % name for name in columns),
+                   zip(*(_plain(values).tolist() for values in columns.values()), rowid.tolist()))
+
+
+def _insert(db, table, names, labels, columns, chunk_rows):
+    """Insert ``columns`` into ``table``, decoding coded columns."""
+    size = len(columns['year'])
+    for start in range(0, size, chunk_rows):
+        chunk = [(labels[name][columns[name][start:start + chunk_rows]] if name in labels
+                  else _plain(np.asarray(columns[name][start:start + chunk_rows]))).tolist() for name in names]
+        db.executemany('INSERT INTO %s VALUES (%s)' % (table, ', '.join('?' * len(names))), zip(*chunk))
+
+
+def _array(values):
+    """Query results as an array, with NULL read back as NaN."""
+    array = np.array(values)
+    return np.array(values, dtype=float) if array.dtype == object else array
@@ -0,0 +1,137 @@
+import csv
+import io
+
+import flask
+import numpy as np
+
+
+class TableExport:
+    """Streams the rows behind ``my_datatable`` as CSV or Parquet downloads.
+
+    ``/export/table.csv`` and ``/export/table.parquet`` take the table's
+    filters as query arguments: ``continent``, repeated ``country``, the
+    ``from`` and ``to`` years and repeated ``sort=column:direction``. Without
+    ``country`` the whole continent is exported. An unknown continent is a
+    404 and a year span that is not one a 400, both before any row is sent. Rows come from the cube in
+    chunks and are written out as each one arrives, so the download starts
+    at once and memory stays flat however many rows it has.
+
+    Parquet needs pyarrow, which is only imported for a Parquet download.
+    """
+
+    def __init__(self, chunk_rows=65536):
+        self.chunk_rows = chunk_rows
+        self.cube = None
+
+    def init_app(self, server, cube):
+        self.cube = cube
+        server.add_url_rule('/export/table.<fmt>', 'export_table', self.export)
+
+    def export(self, fmt):
+        if fmt == 'csv':
+            write, mimetype = self._csv, 'text/csv'
+        elif fmt == 'parquet':
+            try:
+                import pyarrow.parquet  # noqa: F401
+            except ImportError:
+                flask.abort(501, 'Parquet export needs pyarrow')
+            write, mimetype = self._parquet, 'application/vnd.apache.parquet'
+        else:
+            flask.abort(404)
+
+        args = flask.request.args
+        continent = args.get('continent', '')
+        if continent not in self.cube.continents:
+            flask.abort(404)
+        known = set(self.cube.countries(continent))
+        countries = [country for country in args.getlist('country') if country in known] or sorted(known)
+        years = None
+        if 'from' in args and 'to' in args:
+            years = (args.get('from', type=int), args.get('to', type=int))
+            if None in years:
+                flask.abort(400, '"from" and "to" must be whole years')
+            if years[0] > years[1]:
+                flask.abort(400, '"from" must not be after "to"')
+        sort_by = [dict(zip(('column_id', 'direction'), (value.split(':', 1) + ['asc'])[:2]))
+                   for value in args.getlist('sort')]
+
+        chunks = self.cube.iter_table(continent, countries, years, sort_by, chunk_rows=self.chunk_rows)
+        response = flask.Response(write(chunks), mimetype=mimetype)
+        # Only a continent of the data gets here, so the name is safe to send.
+        response.headers['Content-Disposition'] = 'attachment; filename="%s.%s"' % (continent.lower(), fmt)
+        return response
+
+    def _csv(self, chunks):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(self.cube.names)
+        yield _drain(buffer).encode()
+        for chunk in chunks:
+            writer.writerows(zip(*(_csv_values(values) for values in chunk.values())))
+            yield _drain(buffer).encode()
+
+    def _parquet(self, chunks):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        # One row group per chunk, handed to the client as soon as the
+        # writer has flushed it.
+        sink = _Sink()
+        writer = None
+        for chunk in chunks:
+            table = pa.table({name: pa.array(values, from_pandas=True) for name, values in chunk.items()})
+            if writer is None:
+                writer = pq.ParquetWriter(sink, table.schema)
+            writer.write_table(table.cast(writer.schema))
+            yield sink.drain()
+        if writer is None:
+            writer = pq.ParquetWriter(sink, pa.schema([(name, pa.null()) for name in self.cube.names]))
+        writer.close()
+        yield sink.drain()
+
+
+class _Sink(io.RawIOBase):
+    """Write-only file that hands over what was written so far on ``drain``.
+
+    Unlike emptying a BytesIO, ``tell`` keeps counting from the start of
+    the file, which the Parquet footer's offsets rely on.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._pieces = []
+        self._written = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._pieces.append(bytes(data))
+        self._written += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._written
+
+    def drain(self):
+        data = b''.join(self._pieces)
+        self._pieces = []
+        return data
+
+
+def _drain(buffer):
+    data = buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+    return data
+
+
+def _csv_values(values):
+    """Column values for ``csv``, with NaN written as an empty field like None."""
+    if isinstance(values, np.ndarray) and values.dtype.kind == 'f':
+        values = values.astype(object)
+        values[values != values] = None
+    return values
+
+
+table_export = TableExport()
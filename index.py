@@ -1,21 +1,240 @@
+import time
+# Taken before anything else is imported, so the startup report covers imports.
+started = time.perf_counter()
+
 import dash
 import dash_core_components as dcc
 import dash_html_components as html
-from dash.dependencies import Input, Output
-import plotly.graph_objs as go
-import pandas as pd
+from dash.dependencies import Input, Output, State, ClientsideFunction
+from dash.exceptions import PreventUpdate
 import dash_table as dt
+from dash_table.Format import Format, Scheme, Sign
+import os
 import pathlib
 
+from cache import WarmStore, memoize
+from columnar import default_store_dir
+from data_access import DERIVED, ROLLING, SERIES, open_cube, refresh_cube
+from export import table_export
+import fastjson
+from instrumentation import Stopwatch, instrumentation, phase, timed
+from jobs import jobs
+from pages import pages
+from refresh import refresher
+from scheduler import coalesce
+
+startup = Stopwatch(started)
+startup.lap('imports')
+
 
 PATH = pathlib.Path(__file__).parent
 DATA_PATH = PATH.joinpath("./data").resolve()
 
-data = pd.read_csv(DATA_PATH.joinpath('gapminderDataFiveYear.csv'))
+DATA_FILE = os.environ.get('DASHBOARD_DATA', DATA_PATH.joinpath('gapminderDataFiveYear.csv'))
+
+# 'memory' or 'sqlite'; see data_access.open_cube.
+DATA_BACKEND = os.environ.get('DASHBOARD_BACKEND', 'memory')
+
+# CSV files moved into this directory are added to the data, like rows
+# appended to DATA_FILE; both are picked up every DASHBOARD_WATCH seconds.
+DATA_DROP = os.environ.get('DASHBOARD_DROP')
+
+cube = open_cube(DATA_FILE, DATA_BACKEND, DATA_DROP)
+startup.lap('data')
+
+year_list = cube.years
+
+# Selections touching more rows than this run on the job queue instead of
+# the request thread, and the browser polls for their progress.
+HEAVY_ROWS = int(os.environ.get('DASHBOARD_HEAVY_ROWS', 200000))
+
+# Longer series are downsampled to about this many points, roughly one per
+# horizontal pixel of line_chart; zooming in fetches the same again for
+# the zoomed span.
+LOD_POINTS = int(os.environ.get('DASHBOARD_LOD_POINTS', 1000))
+
+# With a tick in milliseconds, line_chart asks this often for points added
+# to the data (see DASHBOARD_WATCH) after the ones it shows, and appends
+# them in place, keeping the last STREAM_POINTS of each trace.
+STREAM_MS = int(os.environ.get('DASHBOARD_STREAM_MS', 0))
+STREAM_POINTS = int(os.environ.get('DASHBOARD_STREAM_POINTS', 2000))
+
+# Part of every cache key and of the warm store's name. Bump it with any
+# change to what a memoized callback returns, or cached results from
+# before the deploy are served for the same data.
+RESULT_FORMAT = 5
+
+
+def warm_store(version):
+    return WarmStore(default_store_dir(DATA_FILE) / ('%s.r%d.warm' % (version, RESULT_FORMAT)))
+
+
+# Dropdown options per continent, so picking a continent fills the country
+# list and its default in a single callback.
+def make_country_options(cube):
+    return {continent: [{'label': i, 'value': i} for i in cube.countries(continent)]
+            for continent in cube.continents}
+
+
+country_options = make_country_options(cube)
+
+
+def line_chart_template(column, label, title, color, texttemplate, textposition, title_y, decimals,
+                        reverse_y = False):
+    return {
+        'column': column,
+        'title': '<b>' + title,
+        'trace': dict(
+                type = 'scatter',
+                mode = 'text+markers+lines',
+                texttemplate = texttemplate,
+                textposition = textposition,
+                line = dict(width = 3, color = color),
+                marker = dict(size = 10, symbol = 'circle', color = color,
+                              line = dict(color = color, width = 2)
+                              ),
+                textfont = dict(
+                    family = "sans-serif",
+                    size = 12,
+                    color = 'black'),
+
+                hovertemplate =
+                '<b>Country</b>: %{meta[0]}<br>' +
+                '<b>Year</b>: %{x}<br>' +
+                '<b>Continent</b>: %{meta[1]}<br>' +
+                '<b>' + label + '</b>: %{y:,.' + str(decimals) + 'f}<br>' +
+                '<extra></extra>'
+
+            ),
+
+        'layout': dict(
+             plot_bgcolor='#F2F2F2',
+             paper_bgcolor='#F2F2F2',
+             title={
+                'text': '<b>' + title,
+
+                'y': title_y,
+                'x': 0.5,
+                'xanchor': 'center',
+                'yanchor': 'top',
+                'font': {
+                        'color': color,
+                        'size': 17}},
+
+             hovermode='closest',
+             margin = dict(t = 15, r = 0),
+
+             xaxis = dict(title = '<b>Years</b>',
+                          visible = True,
+                          color = 'black',
+                          showline = True,
+                          showgrid = False,
+                          showticklabels = True,
+                          linecolor = 'black',
+                          linewidth = 1,
+                          ticks = 'outside',
+                          tickfont = dict(
+                             family = 'Arial',
+                             size = 12,
+                             color = 'black')
+
+                         ),
 
-year_list = list(data['year'].unique())
+             # Ranks read best first, with 1 at the top.
+             yaxis = dict(title = '<b>' + label + '</b>',
+                          autorange = 'reversed' if reverse_y else True,
+                          visible = True,
+                          color = 'black',
+                          showline = False,
+                          showgrid = True,
+                          showticklabels = True,
+                          linecolor = 'black',
+                          linewidth = 1,
+                          ticks = '',
+                          tickfont = dict(
+                             family = 'Arial',
+                             size = 12,
+                             color = 'black')
+
+                         ),
+
+            legend = {
+                'orientation': 'h',
+                'bgcolor': '#1f2c56',
+                'x': 0.5,
+                'y': 1.25,
+                'xanchor': 'center',
+                'yanchor': 'top'},
+
+            font = dict(
+                family = "sans-serif",
+                size = 12,
+                color = 'white'),
+
+        )
+
+    }
+
+# Built once as plain dicts and shipped to the browser with the layout; the
+# clientside render callback fills in the series and the title years.
+line_chart_templates = {
+    'life_expectancy': line_chart_template('lifeExp', 'Life Expectancy', 'Life expectancy', '#38D56F',
+                                           '%{text:.0f}', 'bottom right', 0.99, 3),
+    'population': line_chart_template('pop', 'Population', 'Population', '#9A38D5',
+                                      '%{text:,.2s}', 'top center', 0.99, 0),
+    'gdp_Per_cap': line_chart_template('gdpPercap', 'gdpPercap', 'gdpPercap', '#FFA07A',
+                                       '%{text:,.0f}', 'bottom right', 1, 6),
+    'life_expectancy_growth': line_chart_template('lifeExp_growth', 'Life Expectancy growth (%)',
+                                                  'Life expectancy growth', '#38D56F',
+                                                  '%{text:+.1f}%', 'bottom right', 0.99, 2),
+    'population_growth': line_chart_template('pop_growth', 'Population growth (%)', 'Population growth',
+                                             '#9A38D5', '%{text:+.1f}%', 'top center', 0.99, 2),
+    'gdp_Per_cap_growth': line_chart_template('gdpPercap_growth', 'gdpPercap growth (%)', 'gdpPercap growth',
+                                              '#FFA07A', '%{text:+.1f}%', 'bottom right', 1, 2),
+    'life_expectancy_avg': line_chart_template('lifeExp_avg', 'Life Expectancy (%d-obs. avg)' % ROLLING,
+                                               'Life expectancy, rolling average', '#38D56F',
+                                               '%{text:.0f}', 'bottom right', 0.99, 3),
+    'population_avg': line_chart_template('pop_avg', 'Population (%d-obs. avg)' % ROLLING,
+                                          'Population, rolling average', '#9A38D5',
+                                          '%{text:,.2s}', 'top center', 0.99, 0),
+    'gdp_Per_cap_avg': line_chart_template('gdpPercap_avg', 'gdpPercap (%d-obs. avg)' % ROLLING,
+                                           'gdpPercap, rolling average', '#FFA07A',
+                                           '%{text:,.0f}', 'bottom right', 1, 6),
+    'life_expectancy_rank': line_chart_template('lifeExp_rank', 'Life Expectancy rank in continent',
+                                                'Life expectancy rank', '#38D56F',
+                                                '%{text:.0f}', 'bottom right', 0.99, 0, reverse_y = True),
+    'population_rank': line_chart_template('pop_rank', 'Population rank in continent', 'Population rank',
+                                           '#9A38D5', '%{text:.0f}', 'top center', 0.99, 0, reverse_y = True),
+    'gdp_Per_cap_rank': line_chart_template('gdpPercap_rank', 'gdpPercap rank in continent', 'gdpPercap rank',
+                                            '#FFA07A', '%{text:.0f}', 'bottom right', 1, 0, reverse_y = True),
+    'life_expectancy_pct': line_chart_template('lifeExp_pct', 'Life Expectancy percentile in continent',
+                                               'Life expectancy percentile', '#38D56F',
+                                               '%{text:.0f}', 'bottom right', 0.99, 1),
+    'population_pct': line_chart_template('pop_pct', 'Population percentile in continent',
+                                          'Population percentile', '#9A38D5', '%{text:.0f}', 'top center', 0.99, 1),
+    'gdp_Per_cap_pct': line_chart_template('gdpPercap_pct', 'gdpPercap percentile in continent',
+                                           'gdpPercap percentile', '#FFA07A', '%{text:.0f}', 'bottom right', 1, 1),
+}
+
+# Display formats of the derived table columns, by suffix.
+derived_formats = {
+    '_growth': Format(precision = 2, scheme = Scheme.fixed, sign = Sign.positive),
+    '_avg': Format(precision = 2, scheme = Scheme.fixed),
+    '_rank': Format(precision = 0, scheme = Scheme.fixed),
+    '_pct': Format(precision = 1, scheme = Scheme.fixed),
+}
 
 app = dash.Dash(__name__, meta_tags=[{"name": "viewport", "content": "width=device-width"}])
+app.server.config['COMPRESS_MIN_SIZE'] = 1024
+fastjson.install()
+coalesce.init_app(app.server)
+# Pre-rendered results written by warm.py for this data version, if any.
+memoize.init_app(app.server, version = cube.version, store = warm_store(cube.version),
+                 format = RESULT_FORMAT)
+instrumentation.init_app(app.server)
+table_export.init_app(app.server, cube)
+instrumentation.add_collector('cache', memoize.stats)
+instrumentation.add_collector('scheduler', coalesce.stats)
 
 app.layout = html.Div([
     html.Div([
@@ -41,11 +260,11 @@ app.layout = html.Div([
                          value = 'Asia',
                          placeholder = 'Select Continent',
                          options = [{'label': c, 'value': c}
-                                    for c in data['continent'].unique()], className = 'dcc_compon'),
+                                    for c in cube.continents], className = 'dcc_compon'),
 
 
             dcc.Dropdown(id = 'select_countries',
-                         multi = False,
+                         multi = True,
                          clearable = True,
                          disabled = False,
                          style = {'display': True},
@@ -81,24 +300,52 @@ app.layout = html.Div([
                            labelStyle = {"display": "inline-block"},
                            options = [{'label': 'Life Expectancy', 'value': 'life_expectancy'},
                                       {'label': 'Population', 'value': 'population'},
-                                      {'label': 'gdpPercap', 'value': 'gdp_Per_cap'}],
+                                      {'label': 'gdpPercap', 'value': 'gdp_Per_cap'},
+                                      {'label': 'Life Expectancy growth', 'value': 'life_expectancy_growth'},
+                                      {'label': 'Population growth', 'value': 'population_growth'},
+                                      {'label': 'gdpPercap growth', 'value': 'gdp_Per_cap_growth'},
+                                      {'label': 'Life Expectancy avg', 'value': 'life_expectancy_avg'},
+                                      {'label': 'Population avg', 'value': 'population_avg'},
+                                      {'label': 'gdpPercap avg', 'value': 'gdp_Per_cap_avg'},
+                                      {'label': 'Life Expectancy rank', 'value': 'life_expectancy_rank'},
+                                      {'label': 'Population rank', 'value': 'population_rank'},
+                                      {'label': 'gdpPercap rank', 'value': 'gdp_Per_cap_rank'},
+                                      {'label': 'Life Expectancy percentile', 'value': 'life_expectancy_pct'},
+                                      {'label': 'Population percentile', 'value': 'population_pct'},
+                                      {'label': 'gdpPercap percentile', 'value': 'gdp_Per_cap_pct'}],
                            value = 'life_expectancy',
                            style = {'text-align': 'center', 'color': 'black'},
                            className = 'dcc_compon'),
             dcc.Graph(id = 'line_chart',
                       config = {'displayModeBar': 'hover'}),
+            html.Div([
+                html.Span(id = 'chart_progress'),
+                html.Button('Cancel', id = 'chart_cancel', n_clicks = 0, className = 'job_cancel'),
+            ], id = 'chart_status', hidden = True, className = 'job_status'),
+            dcc.Store(id = 'chart_job'),
+            dcc.Store(id = 'line_chart_series'),
+            dcc.Store(id = 'line_chart_templates', data = line_chart_templates),
+            dcc.Store(id = 'stream_base'),
+            dcc.Store(id = 'stream_cursor'),
 
         ], className = 'create_container2 six columns'),
 
         html.Div([
             dt.DataTable(id = 'my_datatable',
                          columns = [{'name': i, 'id': i} for i in
-                                    data.loc[:, ['country', 'year', 'pop',
-                                                 'continent', 'lifeExp', 'gdpPercap']]],
-                         sort_action = "native",
-                         style_table = {"overflowX": "auto"},
+                                    ['country', 'year', 'pop', 'continent', 'lifeExp', 'gdpPercap']] +
+                                   [{'name': i, 'id': i, 'type': 'numeric', 'hideable': True,
+                                     'format': derived_formats['_' + i.rsplit('_', 1)[1]]} for i in DERIVED],
+                         # Growth and rank show next to the raw columns; the
+                         # rest can be toggled on.
+                         hidden_columns = [i for i in DERIVED if i.endswith(('_avg', '_pct'))],
+                         sort_action = "custom",
                          sort_mode = "multi",
-                         virtualization = True,
+                         sort_by = [],
+                         page_action = "custom",
+                         page_current = 0,
+                         page_size = 15,
+                         style_table = {"overflowX": "auto"},
                          style_cell = {'textAlign': 'left',
                                        'min-width': '100px',
                                        'backgroundColor': '#F2F2F2',
@@ -114,151 +361,97 @@ app.layout = html.Div([
                          style_data = {'textOverflow': 'hidden', 'color': 'black',
                                        'border': '1px solid orange'},
                          fixed_rows = {'headers': True},
-                         )
+                         ),
+            html.Div([
+                html.Span(id = 'table_progress'),
+                html.Button('Cancel', id = 'table_cancel', n_clicks = 0, className = 'job_cancel'),
+            ], id = 'table_status', hidden = True, className = 'job_status'),
+            dcc.Store(id = 'table_job'),
+            html.Div([
+                html.A('Download CSV', id = 'export_csv', className = 'export_link'),
+                html.A('Download Parquet', id = 'export_parquet', className = 'export_link'),
+            ], className = 'export_links'),
 
         ], className = 'create_container2 six columns'),
 
     ], className = "row flex-display"),
 
+    dcc.Interval(id = 'job_poll', interval = 500, disabled = True),
+    dcc.Interval(id = 'stream_tick', interval = STREAM_MS or 1000, disabled = not STREAM_MS),
+
 ], id= "mainContainer", style={"display": "flex", "flex-direction": "column"})
+startup.lap('layout')
 
 @app.callback(
-    Output('select_countries', 'options'),
+    [Output('select_countries', 'options'),
+     Output('select_countries', 'value')],
     Input('select_continent', 'value'))
+@timed
 def get_country_options(select_continent):
-    data1 = data[data['continent'] == select_continent]
-    return [{'label': i, 'value': i} for i in data1['country'].unique()]
+    with phase('lookup'):
+        options = country_options.get(select_continent, [])
+    return options, [options[0]['value']] if options else []
 
 
-@app.callback(
-    Output('select_countries', 'value'),
-    Input('select_countries', 'options'))
-def get_country_value(select_countries):
-    return [k['value'] for k in select_countries][0]
+def as_list(select_countries):
+    if select_countries is None:
+        return []
+    return [select_countries] if isinstance(select_countries, str) else select_countries
 
 
-@app.callback(Output('text1', 'children'),
-              [Input('select_continent', 'value')],
-              [Input('select_years', 'value')])
+def format_growth(growth):
+    # None or NaN for a country's first observation.
+    return 'n/a' if growth is None or growth != growth else '{0:+.1f}%'.format(growth)
 
-def update_text(select_continent, select_years):
-    data1 = data.groupby(['country', 'year', 'continent'])[['pop', 'lifeExp', 'gdpPercap']].sum().reset_index()
-    data2 = data1[(data1['continent'] == select_continent) & (data1['year'] >= select_years[0]) & (data1['year'] <= select_years[1])].nlargest(1, columns = ['pop'])
-    data_continent = data2['continent'].iloc[0]
-    top_year = data2['year'].iloc[0]
-    top_country = data2['country'].iloc[0]
-    top_pop = data2['pop'].iloc[0]
 
-    return [
-
-               html.H6('Top country by population in' + ' ' + data_continent,
-                       style = {'textAlign': 'center',
-                                'line-height': '1',
-                                'color': '#006fe6'}
-                       ),
-               html.P('Year:' + '  ' + '{0:.0f}'.format(top_year),
-                      style = {'textAlign': 'center',
-                               'color': 'black',
-                               'fontSize': 15,
-                               'margin-top': '-3px'
-                               }
-                      ),
-               html.P('Country:' + '  ' + top_country,
-                      style = {'textAlign': 'center',
-                               'color': 'black',
-                               'fontSize': 15,
-                               'margin-top': '-10px'
-                               }
-                      ),
-               html.P('Population:' + '  ' + '{0:,.0f}'.format(top_pop),
-                      style = {'textAlign': 'center',
-                               'color': 'black',
-                               'fontSize': 15,
-                               'margin-top': '-10px'
-                               }
-                      ),
-
-
-    ]
-
-@app.callback(Output('text2', 'children'),
-              [Input('select_continent', 'value')],
-              [Input('select_years', 'value')])
-
-def update_text(select_continent, select_years):
-    data1 = data.groupby(['country', 'year', 'continent'])[['pop', 'lifeExp', 'gdpPercap']].sum().reset_index()
-    data2 = data1[(data1['continent'] == select_continent) & (data1['year'] >= select_years[0]) & (data1['year'] <= select_years[1])].nlargest(1, columns = ['lifeExp'])
-    data_continent = data2['continent'].iloc[0]
-    top_year = data2['year'].iloc[0]
-    top_country = data2['country'].iloc[0]
-    top_lifeexp = data2['lifeExp'].iloc[0]
+def kpi_card(title, label, metric, continent, row):
+    if row is None:
+        return []
 
     return [
 
-               html.H6('Top country by life expectancy in' + ' ' + data_continent,
+               html.H6(title + ' ' + continent,
                        style = {'textAlign': 'center',
                                 'line-height': '1',
                                 'color': '#006fe6'}
                        ),
-               html.P('Year:' + '  ' + '{0:.0f}'.format(top_year),
+               html.P('Year:' + '  ' + '{0:.0f}'.format(row['year']),
                       style = {'textAlign': 'center',
                                'color': 'black',
                                'fontSize': 15,
                                'margin-top': '-3px'
                                }
                       ),
-               html.P('Country:' + '  ' + top_country,
+               html.P('Country:' + '  ' + row['country'],
                       style = {'textAlign': 'center',
                                'color': 'black',
                                'fontSize': 15,
                                'margin-top': '-10px'
                                }
                       ),
-               html.P('Life Expectancy:' + '  ' + '{0:,.0f}'.format(top_lifeexp),
+               html.P(label + ':' + '  ' + '{0:,.0f}'.format(row[metric]),
                       style = {'textAlign': 'center',
                                'color': 'black',
                                'fontSize': 15,
                                'margin-top': '-10px'
                                }
                       ),
-
-
-    ]
-
-@app.callback(Output('text3', 'children'),
-              [Input('select_continent', 'value')],
-              [Input('select_years', 'value')])
-
-def update_text(select_continent, select_years):
-    data1 = data.groupby(['country', 'year', 'continent'])[['pop', 'lifeExp', 'gdpPercap']].sum().reset_index()
-    data2 = data1[(data1['continent'] == select_continent) & (data1['year'] >= select_years[0]) & (data1['year'] <= select_years[1])].nlargest(1, columns = ['gdpPercap'])
-    data_continent = data2['continent'].iloc[0]
-    top_year = data2['year'].iloc[0]
-    top_country = data2['country'].iloc[0]
-    top_gdppercap = data2['gdpPercap'].iloc[0]
-
-    return [
-
-               html.H6('Top country by gdpPercap in' + ' ' + data_continent,
-                       style = {'textAlign': 'center',
-                                'line-height': '1',
-                                'color': '#006fe6'}
-                       ),
-               html.P('Year:' + '  ' + '{0:.0f}'.format(top_year),
+               html.P('Growth:' + '  ' + format_growth(row[metric + '_growth']),
                       style = {'textAlign': 'center',
                                'color': 'black',
                                'fontSize': 15,
-                               'margin-top': '-3px'
+                               'margin-top': '-10px'
                                }
                       ),
-               html.P('Country:' + '  ' + top_country,
+               html.P('%d-obs. avg:' % ROLLING + '  ' + '{0:,.0f}'.format(row[metric + '_avg']),
                       style = {'textAlign': 'center',
                                'color': 'black',
                                'fontSize': 15,
                                'margin-top': '-10px'
                                }
                       ),
-               html.P('gdpPercap:' + '  ' + '{0:,.0f}'.format(top_gdppercap),
+               html.P('Rank in continent:' + '  ' + '#{0:.0f} ({1:.1f} pct.)'.format(row[metric + '_rank'],
+                                                                                     row[metric + '_pct']),
                       style = {'textAlign': 'center',
                                'color': 'black',
                                'fontSize': 15,
@@ -269,315 +462,275 @@ def update_text(select_continent, select_years):
 
     ]
 
+@memoize.scoped(lambda select_continent, select_years: cube.generation(select_continent))
+def kpi_cards(select_continent, select_years):
+    with phase('lookup'):
+        top = {metric: cube.top(select_continent, metric, select_years)
+               for metric in ['pop', 'lifeExp', 'gdpPercap']}
+
+    with phase('build'):
+        return (kpi_card('Top country by population in', 'Population', 'pop', select_continent,
+                         top['pop']),
+                kpi_card('Top country by life expectancy in', 'Life Expectancy', 'lifeExp', select_continent,
+                         top['lifeExp']),
+                kpi_card('Top country by gdpPercap in', 'gdpPercap', 'gdpPercap', select_continent,
+                         top['gdpPercap']))
 
 
-@app.callback(Output('line_chart', 'figure'),
+@app.callback([Output('text1', 'children'),
+               Output('text2', 'children'),
+               Output('text3', 'children')],
+              [Input('select_continent', 'value')],
+              [Input('select_years', 'value')])
+@timed
+@coalesce
+def update_text(select_continent, select_years):
+    return kpi_cards(select_continent, select_years)
+
+
+def run_heavy(compute, args, rows, job_id, outputs):
+    """Run ``compute(*args)`` inline when it is cheap, otherwise on the job queue.
+
+    Returns the ``outputs`` results of ``compute`` followed by the job id to
+    keep in the page, the progress text and whether to hide the status line.
+    Poll ticks and cancel clicks only touch the job; a tick that comes
+    together with any other change is treated as that change. Results
+    already cached are returned inline whatever their size.
+    """
+    waiting = (dash.no_update,) * outputs
+    triggers = coalesce.triggered()
+
+    if triggers == {'job_poll.n_intervals'}:
+        if not job_id:
+            raise PreventUpdate
+        state, progress, result, error = jobs.status(job_id)
+        if state == 'done':
+            return tuple(result) + (None, '', True)
+        if state in ('queued', 'running'):
+            return waiting + (job_id, 'Working... {0:.0%}'.format(progress), False)
+        if state == 'cancelled':
+            # Replaced by a newer request or cancelled by the user, and
+            # either has already said so in the page.
+            raise PreventUpdate
+        return waiting + (None, 'Failed: ' + error if state == 'failed' else 'Cancelled', False)
+
+    if job_id:
+        jobs.cancel(job_id)
+    if any(trigger.endswith('_cancel.n_clicks') for trigger in triggers):
+        return waiting + (None, 'Cancelled', False)
+    found, result = memoize.lookup(compute, *args)
+    if found or rows < HEAVY_ROWS:
+        return tuple(result if found else compute(*args)) + (None, '', True)
+    return waiting + (jobs.submit(compute, *args), 'Working...', False)
+
+
+def zoom_window(relayout_data):
+    """Year span line_chart is zoomed to, or None when it shows everything."""
+    relayout_data = relayout_data or {}
+    if 'xaxis.range[0]' in relayout_data:
+        return relayout_data['xaxis.range[0]'], relayout_data['xaxis.range[1]']
+    if 'xaxis.range' in relayout_data:
+        return tuple(relayout_data['xaxis.range'])
+    return None
+
+
+# Keyed by the whole continent, like table_page, for the rank and
+# percentile series.
+@memoize.scoped(lambda select_continent, *args: cube.generation(select_continent))
+def series_data(select_continent, select_countries, window):
+    with phase('lookup'):
+        # One country at a time, so a job reports progress and can be
+        # cancelled in between.
+        series = []
+        for done, country in enumerate(select_countries):
+            jobs.report(done / len(select_countries))
+            series += cube.series(select_continent, [country], points=LOD_POINTS, window=window)
+
+    return ({
+        'continent': select_continent,
+        'series': series,
+    },)
+
+
+@app.callback([Output('line_chart_series', 'data'),
+               Output('chart_job', 'data'),
+               Output('chart_progress', 'children'),
+               Output('chart_status', 'hidden')],
               [Input('select_continent', 'value')],
               [Input('select_countries', 'value')],
-              [Input('select_years', 'value')],
-              [Input('radio_items', 'value')])
-
-def update_graph(select_continent, select_countries, select_years, radio_items):
-    data1 = data.groupby(['country', 'year', 'continent'])[['pop', 'lifeExp', 'gdpPercap']].sum().reset_index()
-    data2 = data1[(data1['continent'] == select_continent) & (data1['country'] == select_countries) &
-                  (data1['year'] >= select_years[0]) & (data1['year'] <= select_years[1])]
-
-    if radio_items == 'life_expectancy':
-
-     return {
-        'data':[
-            go.Scatter(
-                x = data2['year'],
-                y = data2['lifeExp'],
-                mode = 'text + markers + lines',
-                text = data2['lifeExp'],
-                texttemplate = '%{text:.0f}',
-                textposition = 'bottom right',
-                line = dict(width = 3, color = '#38D56F'),
-                marker = dict(size = 10, symbol = 'circle', color = '#38D56F',
-                              line = dict(color = '#38D56F', width = 2)
-                              ),
-                textfont = dict(
-                    family = "sans-serif",
-                    size = 12,
-                    color = 'black'),
-
-                hoverinfo = 'text',
-                hovertext =
-                '<b>Country</b>: ' + data2['country'].astype(str) + '<br>' +
-                '<b>Year</b>: ' + data2['year'].astype(str) + '<br>' +
-                '<b>Continent</b>: ' + data2['continent'].astype(str) + '<br>' +
-                '<b>Life Expectancy</b>: ' + [f'{x:,.3f}' for x in data2['lifeExp']] + '<br>'
-
-            )],
-
-
-        'layout': go.Layout(
-             plot_bgcolor='#F2F2F2',
-             paper_bgcolor='#F2F2F2',
-             title={
-                'text': '<b>Life expectancy' + ' ' + ' to '.join([str(y) for y in select_years]),
-
-                'y': 0.99,
-                'x': 0.5,
-                'xanchor': 'center',
-                'yanchor': 'top'},
-             titlefont={
-                        'color': '#38D56F',
-                        'size': 17},
-
-             hovermode='closest',
-             margin = dict(t = 15, r = 0),
-
-             xaxis = dict(title = '<b>Years</b>',
-                          visible = True,
-                          color = 'black',
-                          showline = True,
-                          showgrid = False,
-                          showticklabels = True,
-                          linecolor = 'black',
-                          linewidth = 1,
-                          ticks = 'outside',
-                          tickfont = dict(
-                             family = 'Arial',
-                             size = 12,
-                             color = 'black')
-
-                         ),
-
-             yaxis = dict(title = '<b>Life Expectancy</b>',
-                          visible = True,
-                          color = 'black',
-                          showline = False,
-                          showgrid = True,
-                          showticklabels = True,
-                          linecolor = 'black',
-                          linewidth = 1,
-                          ticks = '',
-                          tickfont = dict(
-                             family = 'Arial',
-                             size = 12,
-                             color = 'black')
-
-                         ),
-
-            legend = {
-                'orientation': 'h',
-                'bgcolor': '#1f2c56',
-                'x': 0.5,
-                'y': 1.25,
-                'xanchor': 'center',
-                'yanchor': 'top'},
-
-            font = dict(
-                family = "sans-serif",
-                size = 12,
-                color = 'white'),
-
-        )
-
-    }
-
-    elif radio_items == 'population':
-
-     return {
-        'data':[
-            go.Scatter(
-                x = data2['year'],
-                y = data2['pop'],
-                mode = 'text + markers + lines',
-                text = data2['pop'],
-                texttemplate = '%{text:,.2s}',
-                textposition = 'top center',
-                line = dict(width = 3, color = '#9A38D5'),
-                marker = dict(size = 10, symbol = 'circle', color = '#9A38D5',
-                              line = dict(color = '#9A38D5', width = 2)
-                              ),
-                textfont = dict(
-                    family = "sans-serif",
-                    size = 12,
-                    color = 'black'),
-
-                hoverinfo = 'text',
-                hovertext =
-                '<b>Country</b>: ' + data2['country'].astype(str) + '<br>' +
-                '<b>Year</b>: ' + data2['year'].astype(str) + '<br>' +
-                '<b>Continent</b>: ' + data2['continent'].astype(str) + '<br>' +
-                '<b>Population</b>: ' + [f'{x:,.0f}' for x in data2['pop']] + '<br>'
-
-            )],
-
-
-        'layout': go.Layout(
-             plot_bgcolor='#F2F2F2',
-             paper_bgcolor='#F2F2F2',
-             title={
-                'text': '<b>Population' + ' ' + ' to '.join([str(y) for y in select_years]),
-
-                'y': 0.99,
-                'x': 0.5,
-                'xanchor': 'center',
-                'yanchor': 'top'},
-             titlefont={
-                        'color': '#9A38D5',
-                        'size': 17},
-
-             hovermode='closest',
-             margin = dict(t = 15, r = 0),
-
-             xaxis = dict(title = '<b>Years</b>',
-                          visible = True,
-                          color = 'black',
-                          showline = True,
-                          showgrid = False,
-                          showticklabels = True,
-                          linecolor = 'black',
-                          linewidth = 1,
-                          ticks = 'outside',
-                          tickfont = dict(
-                             family = 'Arial',
-                             size = 12,
-                             color = 'black')
-
-                         ),
-
-             yaxis = dict(title = '<b>Population</b>',
-                          visible = True,
-                          color = 'black',
-                          showline = False,
-                          showgrid = True,
-                          showticklabels = True,
-                          linecolor = 'black',
-                          linewidth = 1,
-                          ticks = '',
-                          tickfont = dict(
-                             family = 'Arial',
-                             size = 12,
-                             color = 'black')
-
-                         ),
-
-            legend = {
-                'orientation': 'h',
-                'bgcolor': '#1f2c56',
-                'x': 0.5,
-                'y': 1.25,
-                'xanchor': 'center',
-                'yanchor': 'top'},
-
-            font = dict(
-                family = "sans-serif",
-                size = 12,
-                color = 'white'),
-
-        )
-
-    }
-
-    elif radio_items == 'gdp_Per_cap':
-
-     return {
-        'data':[
-            go.Scatter(
-                x = data2['year'],
-                y = data2['gdpPercap'],
-                mode = 'text + markers + lines',
-                text = data2['gdpPercap'],
-                texttemplate = '%{text:,.0f}',
-                textposition = 'bottom right',
-                line = dict(width = 3, color = '#FFA07A'),
-                marker = dict(size = 10, symbol = 'circle', color = '#FFA07A',
-                              line = dict(color = '#FFA07A', width = 2)
-                              ),
-                textfont = dict(
-                    family = "sans-serif",
-                    size = 12,
-                    color = 'black'),
-
-                hoverinfo = 'text',
-                hovertext =
-                '<b>Country</b>: ' + data2['country'].astype(str) + '<br>' +
-                '<b>Year</b>: ' + data2['year'].astype(str) + '<br>' +
-                '<b>Continent</b>: ' + data2['continent'].astype(str) + '<br>' +
-                '<b>gdpPercap</b>: ' + [f'{x:,.6f}' for x in data2['gdpPercap']] + '<br>'
-
-            )],
-
-
-        'layout': go.Layout(
-             plot_bgcolor='#F2F2F2',
-             paper_bgcolor='#F2F2F2',
-             title={
-                'text': '<b>gdpPercap' + ' ' + ' to '.join([str(y) for y in select_years]),
-
-                'y': 1,
-                'x': 0.5,
-                'xanchor': 'center',
-                'yanchor': 'top'},
-             titlefont={
-                        'color': '#FFA07A',
-                        'size': 17},
-
-             hovermode='closest',
-             margin = dict(t = 15, r = 0),
-
-             xaxis = dict(title = '<b>Years</b>',
-                          visible = True,
-                          color = 'black',
-                          showline = True,
-                          showgrid = False,
-                          showticklabels = True,
-                          linecolor = 'black',
-                          linewidth = 1,
-                          ticks = 'outside',
-                          tickfont = dict(
-                             family = 'Arial',
-                             size = 12,
-                             color = 'black')
-
-                         ),
-
-             yaxis = dict(title = '<b>gdpPercap</b>',
-                          visible = True,
-                          color = 'black',
-                          showline = False,
-                          showgrid = True,
-                          showticklabels = True,
-                          linecolor = 'black',
-                          linewidth = 1,
-                          ticks = '',
-                          tickfont = dict(
-                             family = 'Arial',
-                             size = 12,
-                             color = 'black')
-
-                         ),
-
-            legend = {
-                'orientation': 'h',
-                'bgcolor': '#1f2c56',
-                'x': 0.5,
-                'y': 1.25,
-                'xanchor': 'center',
-                'yanchor': 'top'},
-
-            font = dict(
-                family = "sans-serif",
-                size = 12,
-                color = 'white'),
-
-        )
-
-    }
-
-@app.callback(Output('my_datatable', 'data'),
+              [Input('line_chart', 'relayoutData')],
+              [Input('job_poll', 'n_intervals')],
+              [Input('chart_cancel', 'n_clicks')],
+              [State('chart_job', 'data')])
+@timed
+@coalesce
+def update_graph(select_continent, select_countries, relayout_data, n_intervals, n_clicks, chart_job):
+    select_countries = as_list(select_countries)
+    # Dash keeps passing the last relayoutData, so the zoom only counts when
+    # it is what changed (a poll tick aside), and only for series that are
+    # downsampled at all; otherwise it would only split the cache of
+    # identical results.
+    window = None
+    if coalesce.triggered() - {'job_poll.n_intervals'} == {'line_chart.relayoutData'}:
+        window = zoom_window(relayout_data)
+        if window is None and 'xaxis.autorange' not in (relayout_data or {}):
+            raise PreventUpdate
+        if all(cube.count(select_continent, [country]) <= LOD_POINTS for country in select_countries):
+            raise PreventUpdate
+    return run_heavy(series_data, (select_continent, select_countries, window),
+                     cube.count(select_continent, select_countries), chart_job, 1)
+
+app.clientside_callback(
+    ClientsideFunction(namespace = 'line_chart', function_name = 'render'),
+    Output('line_chart', 'figure'),
+    [Input('line_chart_series', 'data')],
+    [Input('select_years', 'value')],
+    [Input('radio_items', 'value')],
+    [State('line_chart_templates', 'data')])
+
+app.clientside_callback(
+    ClientsideFunction(namespace = 'line_chart', function_name = 'stream_base'),
+    Output('stream_base', 'data'),
+    [Input('line_chart_series', 'data')],
+    [Input('select_years', 'value')],
+    [Input('radio_items', 'value')],
+    [State('line_chart_templates', 'data')])
+
+
+@app.callback([Output('line_chart', 'extendData'),
+               Output('stream_cursor', 'data')],
+              [Input('stream_tick', 'n_intervals')],
+              [State('stream_base', 'data')],
+              [State('stream_cursor', 'data')])
+@timed
+def stream_points(n_intervals, stream_base, stream_cursor):
+    """Points of the drawn traces added since, for extendData to append in the browser.
+
+    ``stream_base`` says where each trace ended when it was drawn and
+    ``stream_cursor`` what was appended to it since. Only rows after those
+    are read and sent, and nothing at all while the generation of the
+    countries drawn is unchanged, so a tick costs the new points rather
+    than the series.
+    """
+    if not stream_base or stream_base['column'] not in SERIES:
+        raise PreventUpdate
+    if not stream_cursor or stream_cursor['base'] != stream_base:
+        # Drawn again; start over from what the figure now holds.
+        stream_cursor = {'base': stream_base, 'last': stream_base['last'], 'generation': None}
+    continent, countries = stream_base['continent'], stream_base['countries']
+    generation = cube.generation(continent, countries)
+    if generation == stream_cursor['generation']:
+        raise PreventUpdate
+
+    with phase('lookup'):
+        stop = year_list[-1] if stream_base['follow'] else stream_base['to']
+        last, traces, x, y = list(stream_cursor['last']), [], [], []
+        for trace, country in enumerate(countries):
+            start = stream_base['from'] if last[trace] is None else max(stream_base['from'], last[trace] + 1)
+            if start > stop:
+                continue
+            series, = cube.series(continent, [country], (start, stop))
+            if series['year']:
+                traces.append(trace)
+                x.append(series['year'][-STREAM_POINTS:])
+                y.append(series[stream_base['column']][-STREAM_POINTS:])
+                last[trace] = series['year'][-1]
+
+    stream_cursor = dict(stream_cursor, last=last, generation=generation)
+    if not traces:
+        return dash.no_update, stream_cursor
+    return [{'x': x, 'y': y}, traces, STREAM_POINTS], stream_cursor
+
+
+# Keyed by the whole continent: the rank and percentile columns of a
+# country's rows change with the rows of every other country in it.
+@memoize.scoped(lambda select_continent, *args: cube.generation(select_continent))
+def table_page(select_continent, select_countries, select_years, page_current, page_size, sort_by):
+    with phase('lookup'):
+        page_count = max(1, -(-cube.count(select_continent, select_countries, select_years) // page_size))
+        page_current = min(page_current or 0, page_count - 1)
+        data_table = cube.table(select_continent, select_countries, select_years, sort_by or [],
+                                page_current * page_size, (page_current + 1) * page_size, progress=jobs.report)
+
+    with phase('build'):
+        return data_table, page_count
+
+
+@app.callback([Output('my_datatable', 'data'),
+               Output('my_datatable', 'page_count'),
+               Output('table_job', 'data'),
+               Output('table_progress', 'children'),
+               Output('table_status', 'hidden')],
               [Input('select_continent', 'value')],
               [Input('select_countries', 'value')],
-              [Input('select_years', 'value')])
-def display_table(select_continent, select_countries, select_years):
-    data_table = data[(data['continent'] == select_continent) & (data['country'] == select_countries) &
-                      (data['year'] >= select_years[0]) & (data['year'] <= select_years[1])]
-    return data_table.to_dict('records')
+              [Input('select_years', 'value')],
+              [Input('my_datatable', 'page_current')],
+              [Input('my_datatable', 'page_size')],
+              [Input('my_datatable', 'sort_by')],
+              [Input('job_poll', 'n_intervals')],
+              [Input('table_cancel', 'n_clicks')],
+              [State('table_job', 'data')])
+@timed
+@coalesce
+def display_table(select_continent, select_countries, select_years, page_current, page_size, sort_by,
+                  n_intervals, n_clicks, table_job):
+    select_countries = as_list(select_countries)
+    return run_heavy(table_page, (select_continent, select_countries, select_years, page_current, page_size,
+                                  sort_by or []),
+                     cube.count(select_continent, select_countries, select_years), table_job, 2)
+
+app.clientside_callback(
+    ClientsideFunction(namespace = 'table_export', function_name = 'links'),
+    [Output('export_csv', 'href'),
+     Output('export_parquet', 'href')],
+    [Input('select_continent', 'value')],
+    [Input('select_countries', 'value')],
+    [Input('select_years', 'value')],
+    [Input('my_datatable', 'sort_by')])
+
+app.clientside_callback(
+    """
+    function(chart_job, table_job) {
+        return !(chart_job || table_job);
+    }
+    """,
+    Output('job_poll', 'disabled'),
+    [Input('chart_job', 'data')],
+    [Input('table_job', 'data')])
+
+def refresh_data():
+    """Swap in rows added to the data since the last call; returns whether there were any.
+
+    Cached results stay valid unless the new rows touch what they were
+    computed from, as keyed by ``cube.generation``.
+    """
+    global cube, year_list, country_options
+    refreshed = refresh_cube(cube, DATA_FILE, DATA_BACKEND, DATA_DROP)
+    if refreshed is None:
+        return False
+    previous, cube, year_list = cube, refreshed, refreshed.years
+    country_options = make_country_options(cube)
+    table_export.cube = cube
+    if cube.version != previous.version:
+        memoize.version = cube.version
+        memoize.store = warm_store(cube.version)
+
+    app.layout['select_continent'].options = [{'label': c, 'value': c} for c in cube.continents]
+    slider = app.layout['select_years']
+    slider.min, slider.max = year_list[0], year_list[-1]
+    slider.marks = {str(yr): str(yr) for yr in year_list}
+    pages.render()
+    app.logger.info('data refreshed: %d rows, %d years', len(cube), len(year_list))
+    return True
+
+# Rendered once all callbacks are registered, as inline clientside callbacks
+# end up in the index page.
+pages.init_app(app)
+startup.lap('pages')
+refresher.init_app(app.server, refresh_data)
+instrumentation.add_collector('startup', startup.stats)
+instrumentation.add_collector('refresh', refresher.stats)
+app.logger.info('ready in %s', startup.report())
 
 if __name__ == '__main__':
     app.run_server(debug=True)
\ No newline at end of file
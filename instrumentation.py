@@ -0,0 +1,187 @@
+import bisect
+import collections
+import contextlib
+import functools
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+
+import flask
+
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+logger = logging.getLogger(__name__)
+
+
+class Instrumentation:
+    """Per-callback phase timings for Server-Timing headers and ``/metrics``.
+
+    Callbacks wrapped with ``timed`` mark their data lookup and component
+    building with ``phase``; whatever the request spends outside them
+    (argument parsing and JSON serialization) is reported as the
+    ``serialize`` phase. Metrics are kept per process.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._requests = collections.Counter()
+        self._collectors = {}
+        self.slow_ms = float(os.environ.get('DASHBOARD_PROFILE_SLOW_MS', 0))
+        self.on_slow = log_slow_request
+
+    def timed(self, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            flask.g.callback_name = func.__name__
+            return func(*args, **kwargs)
+
+        return wrapper
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            if flask.has_request_context():
+                phases = flask.g.setdefault('phases', collections.OrderedDict())
+                phases[name] = phases.get(name, 0) + time.perf_counter() - start
+
+    def observe(self, callback, phase, seconds):
+        with self._lock:
+            histogram = self._histograms.get((callback, phase))
+            if histogram is None:
+                histogram = self._histograms[callback, phase] = [[0] * len(BUCKETS), 0.0, 0]
+            index = bisect.bisect_left(BUCKETS, seconds)
+            if index < len(BUCKETS):
+                histogram[0][index] += 1
+            histogram[1] += seconds
+            histogram[2] += 1
+
+    def add_collector(self, name, collect):
+        """Export the numbers returned by ``collect()`` as the ``dashboard_<name>`` gauge."""
+        self._collectors[name] = collect
+
+    def render(self):
+        lines = ['# HELP dashboard_callback_seconds Time spent per callback phase.',
+                 '# TYPE dashboard_callback_seconds histogram']
+        with self._lock:
+            histograms = {key: (list(counts), total, count)
+                          for key, (counts, total, count) in self._histograms.items()}
+            requests = dict(self._requests)
+        for (callback, phase), (counts, total, count) in sorted(histograms.items()):
+            labels = 'callback="%s",phase="%s"' % (callback, phase)
+            cumulative = 0
+            for bound, bucket in zip(BUCKETS, counts):
+                cumulative += bucket
+                lines.append('dashboard_callback_seconds_bucket{%s,le="%g"} %d' % (labels, bound, cumulative))
+            lines.append('dashboard_callback_seconds_bucket{%s,le="+Inf"} %d' % (labels, count))
+            lines.append('dashboard_callback_seconds_sum{%s} %.6f' % (labels, total))
+            lines.append('dashboard_callback_seconds_count{%s} %d' % (labels, count))
+
+        lines += ['# HELP dashboard_callback_requests_total Callback requests by status.',
+                  '# TYPE dashboard_callback_requests_total counter']
+        for (callback, status), count in sorted(requests.items()):
+            lines.append('dashboard_callback_requests_total{callback="%s",status="%s"} %d'
+                         % (callback, status, count))
+
+        for name, collect in sorted(self._collectors.items()):
+            lines.append('# TYPE dashboard_%s gauge' % name)
+            for stat, value in sorted(collect().items()):
+                lines.append('dashboard_%s{stat="%s"} %s' % (name, stat, value))
+        return '\n'.join(lines) + '\n'
+
+    def init_app(self, server):
+        @server.before_request
+        def start_timer():
+            if flask.request.path.endswith('/_dash-update-component'):
+                flask.g.request_start = time.perf_counter()
+                if self.slow_ms:
+                    flask.g.sampler = StackSampler(threading.get_ident())
+
+        @server.after_request
+        def add_server_timing(response):
+            start = flask.g.get('request_start')
+            if start is None:
+                return response
+            total = time.perf_counter() - start
+            callback = flask.g.get('callback_name', 'unknown')
+            phases = flask.g.get('phases', {})
+            phases['serialize'] = max(0.0, total - sum(phases.values()))
+
+            for name, seconds in phases.items():
+                self.observe(callback, name, seconds)
+            self.observe(callback, 'total', total)
+            with self._lock:
+                self._requests[callback, response.status_code] += 1
+
+            response.headers['Server-Timing'] = ', '.join(
+                '%s;dur=%.2f' % (name, seconds * 1000) for name, seconds in list(phases.items()) + [('total', total)])
+
+            sampler = flask.g.get('sampler')
+            if sampler is not None:
+                samples = sampler.stop()
+                if total * 1000 >= self.slow_ms:
+                    self.on_slow(callback, total, samples)
+            return response
+
+        server.add_url_rule('/metrics', 'metrics', lambda: flask.Response(
+            self.render(), mimetype='text/plain; version=0.0.4'))
+
+
+class Stopwatch:
+    """Seconds spent in each named step since ``start``, for the startup report."""
+
+    def __init__(self, start=None):
+        self.start = self._last = time.perf_counter() if start is None else start
+        self.steps = collections.OrderedDict()
+
+    def lap(self, name):
+        now = time.perf_counter()
+        self.steps[name] = now - self._last
+        self._last = now
+
+    def stats(self):
+        return dict(self.steps, total=self._last - self.start)
+
+    def report(self):
+        return ', '.join('%s %.0f ms' % (name, seconds * 1000) for name, seconds in self.stats().items())
+
+
+class StackSampler:
+    """Samples one thread's stack at a fixed interval until stopped."""
+
+    def __init__(self, thread_id, interval=0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = collections.Counter()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                stack = traceback.extract_stack(frame)
+                self.samples[';'.join('%s:%s' % (f.name, f.lineno) for f in stack[-12:])] += 1
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+        return self.samples
+
+
+def log_slow_request(callback, seconds, samples):
+    logger.warning('slow callback %s took %.1f ms; hottest stacks:\n%s', callback, seconds * 1000,
+                   '\n'.join('%5d %s' % (count, stack) for stack, count in samples.most_common(5)))
+
+
+instrumentation = Instrumentation()
+phase = instrumentation.phase
+timed = instrumentation.timed
@@ -0,0 +1,120 @@
+import concurrent.futures
+import os
+import pickle
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+
+
+class Cancelled(Exception):
+    pass
+
+
+class JobQueue:
+    """Runs heavy callback work on a local thread pool.
+
+    Job state, progress and results live in a SQLite file, so a browser
+    polling for a job may land on any worker process of the host, and a
+    cancel request is seen by whichever worker runs the job. Work reports
+    progress and checks for cancellation through ``report``.
+    """
+
+    def __init__(self, path=None, workers=None, ttl=600):
+        self.path = path or os.environ.get('DASHBOARD_JOBS') or os.path.join(
+            tempfile.gettempdir(), 'dashboard-jobs.sqlite')
+        self.workers = workers or int(os.environ.get('DASHBOARD_JOB_WORKERS', 0)) or min(4, os.cpu_count() or 1)
+        self.ttl = ttl
+        self._executor = None
+        self._executor_pid = None
+        self._lock = threading.Lock()
+        self._connections = threading.local()
+        self._current = threading.local()
+
+    def submit(self, func, *args):
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        db = self._db()
+        db.execute('DELETE FROM jobs WHERE created < ?', (now - self.ttl,))
+        db.execute("INSERT INTO jobs (id, state, progress, created, cancelled) VALUES (?, 'queued', 0, ?, 0)",
+                   (job_id, now))
+        self._pool().submit(self._run, job_id, func, args)
+        return job_id
+
+    def status(self, job_id):
+        """(state, progress, result, error) of a job; state is None when unknown."""
+        row = self._db().execute('SELECT state, progress, result, error FROM jobs WHERE id = ?',
+                                 (job_id,)).fetchone()
+        if row is None:
+            return None, 0.0, None, None
+        state, progress, result, error = row
+        return state, progress, pickle.loads(result) if result is not None else None, error
+
+    def cancel(self, job_id):
+        """Stop a job and drop its result, so that a poll for it no longer shows anything.
+
+        A running job stops at its next ``report``.
+        """
+        self._db().execute("UPDATE jobs SET cancelled = 1, result = NULL, state = CASE WHEN state = 'running' "
+                           "THEN state ELSE 'cancelled' END WHERE id = ?", (job_id,))
+
+    def report(self, progress=None):
+        """Record progress of the running job and stop it if it was cancelled.
+
+        With ``progress`` None only the cancellation is checked. Does
+        nothing outside a job, so the same code can also run inline.
+        """
+        job_id = getattr(self._current, 'job_id', None)
+        if job_id is None:
+            return
+        db = self._db()
+        if progress is not None:
+            db.execute('UPDATE jobs SET progress = ? WHERE id = ?', (progress, job_id))
+        cancelled, = db.execute('SELECT cancelled FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        if cancelled:
+            raise Cancelled
+
+    def _run(self, job_id, func, args):
+        db = self._db()
+        started = db.execute("UPDATE jobs SET state = 'running' WHERE id = ? AND NOT cancelled",
+                             (job_id,)).rowcount
+        if not started:
+            return
+        self._current.job_id = job_id
+        try:
+            result = pickle.dumps(func(*args), protocol=pickle.HIGHEST_PROTOCOL)
+        except Cancelled:
+            db.execute("UPDATE jobs SET state = 'cancelled' WHERE id = ?", (job_id,))
+        except Exception as error:
+            db.execute("UPDATE jobs SET state = CASE WHEN cancelled THEN 'cancelled' ELSE 'failed' END, "
+                       "error = ? WHERE id = ?", (repr(error), job_id))
+        else:
+            # Cancelled after its last report, the result is dropped all the same.
+            db.execute("UPDATE jobs SET state = CASE WHEN cancelled THEN 'cancelled' ELSE 'done' END, "
+                       "progress = 1, result = CASE WHEN cancelled THEN NULL ELSE ? END WHERE id = ?",
+                       (result, job_id))
+        finally:
+            self._current.job_id = None
+
+    def _pool(self):
+        with self._lock:
+            # Executors do not survive a fork; each worker process starts its own.
+            if self._executor is None or self._executor_pid != os.getpid():
+                self._executor = concurrent.futures.ThreadPoolExecutor(self.workers, thread_name_prefix='job')
+                self._executor_pid = os.getpid()
+            return self._executor
+
+    def _db(self):
+        db = getattr(self._connections, 'db', None)
+        if db is None or self._connections.pid != os.getpid():
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            db.execute('CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, state TEXT, progress REAL, '
+                       'result BLOB, error TEXT, created REAL, cancelled INTEGER)')
+            self._connections.db, self._connections.pid = db, os.getpid()
+        return db
+
+
+jobs = JobQueue()
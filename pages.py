@@ -0,0 +1,67 @@
+import functools
+import hashlib
+
+import flask
+
+
+class PageCache:
+    """Serves the index page and ``/_dash-layout`` from bytes built once.
+
+    Dash rebuilds both on every page load: the index page walks the
+    component registry for its script tags and the layout is serialized
+    from the component tree again. Neither changes once the app is set up,
+    so ``init_app`` renders them at startup and each request gets the same
+    bytes with an ETag; a browser revalidating its copy gets a 304.
+
+    Under ``debug`` the dev tools rewrite both pages, so Dash's own views
+    answer instead. After changing the layout, ``render`` builds them again.
+    """
+
+    def __init__(self):
+        self._pages = {}
+        self._views = {}
+        self.app = None
+        self.server = None
+
+    def init_app(self, app):
+        """Render the pages of ``app``, whose layout must already be set."""
+        self.app, self.server = app, app.server
+        prefix = app.config.routes_pathname_prefix
+        with self.server.test_request_context(prefix):
+            # Dash runs this on the first request; doing it now takes it
+            # out of the first page load.
+            app._setup_server()
+            self.server.before_first_request_funcs.remove(app._setup_server)
+        self.render()
+        for endpoint in (prefix + '_dash-layout', prefix, prefix + '<path:path>'):
+            self._views[endpoint] = self.server.view_functions[endpoint]
+            self.server.view_functions[endpoint] = functools.partial(self._serve, endpoint)
+
+    def render(self):
+        """Render the pages again from the app's current layout."""
+        prefix = self.app.config.routes_pathname_prefix
+        with self.server.test_request_context(prefix):
+            layout = self.app.serve_layout().get_data()
+            index = self.app.index().encode()
+        # Swapped in one go, so no request sees half of a refresh.
+        self._pages = {
+            prefix + '_dash-layout': _page(layout, 'application/json'),
+            prefix: _page(index, 'text/html'),
+            prefix + '<path:path>': _page(index, 'text/html'),
+        }
+
+    def _serve(self, endpoint, *args, **kwargs):
+        if self.server.debug:
+            return self._views[endpoint](*args, **kwargs)
+        body, etag, mimetype = self._pages[endpoint]
+        response = flask.Response(body, mimetype=mimetype)
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response.make_conditional(flask.request)
+
+
+def _page(body, mimetype):
+    return body, hashlib.md5(body).hexdigest(), mimetype
+
+
+pages = PageCache()
@@ -0,0 +1,63 @@
+import collections
+import logging
+import os
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+class Refresher:
+    """Watches the data source and applies new rows without a restart.
+
+    Every ``DASHBOARD_WATCH`` seconds (never when unset or 0) a background
+    thread of each worker process calls the refresh function given to
+    ``init_app``, which returns whether it found anything new. The thread is
+    started by the first request a process serves, so it also runs in
+    workers forked after the app was imported.
+    """
+
+    def __init__(self, interval=None):
+        self.interval = interval if interval is not None else float(os.environ.get('DASHBOARD_WATCH', 0))
+        self.refresh = None
+        self.counters = collections.Counter()
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def init_app(self, server, refresh):
+        self.refresh = refresh
+        if self.interval > 0:
+            server.before_request(self._start)
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters, interval=self.interval)
+
+    def _start(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+        threading.Thread(target=self._watch, name='refresh', daemon=True).start()
+
+    def _watch(self):
+        while True:
+            time.sleep(self.interval)
+            start = time.perf_counter()
+            try:
+                refreshed = self.refresh()
+            except Exception:
+                logger.exception('data refresh failed')
+                with self._lock:
+                    self.counters['failures'] += 1
+                continue
+            if refreshed:
+                with self._lock:
+                    self.counters['refreshes'] += 1
+                    self.counters['last_refresh_ms'] = round(1000 * (time.perf_counter() - start), 1)
+
+
+refresher = Refresher()
@@ -0,0 +1,113 @@
+import functools
+import threading
+import uuid
+
+import dash
+import flask
+from dash.exceptions import PreventUpdate
+
+
+SESSION_COOKIE = 'dash_session'
+
+
+class Coalescer:
+    """Drop callback requests that are superseded before they start running.
+
+    Requests are grouped per browser session and callback. While one request
+    of a group is computing, later ones queue behind it; when the running one
+    finishes, only the newest queued request proceeds and the rest are
+    answered with ``PreventUpdate``. An idle group runs immediately, so the
+    live-drag feel of the RangeSlider is kept.
+
+    The newest request carries the current value of every input, but not
+    what changed in the requests it replaced: a poll tick queued behind a
+    sort change would otherwise run as a bare poll. So the request that
+    runs sees, through ``triggered``, its own triggers and those of every
+    request dropped in its favour.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._groups = {}
+        self.received = 0
+        self.computed = 0
+        self.skipped = 0
+
+    def __call__(self, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            key = (session_id(), func.__name__)
+            triggers = {trigger['prop_id'] for trigger in dash.callback_context.triggered
+                        if trigger['prop_id'] != '.'}
+            with self._lock:
+                self.received += 1
+                group = self._groups.setdefault(key, _Group())
+                group.latest += 1
+                group.waiting += 1
+                group.triggered |= triggers
+                generation = group.latest
+
+            try:
+                with group.running:
+                    with self._lock:
+                        stale = generation != group.latest
+                        if stale:
+                            self.skipped += 1
+                        else:
+                            self.computed += 1
+                            flask.g.coalesced_triggers, group.triggered = group.triggered, set()
+                    if stale:
+                        raise PreventUpdate
+                    return func(*args, **kwargs)
+            finally:
+                with self._lock:
+                    group.waiting -= 1
+                    if not group.waiting:
+                        self._groups.pop(key, None)
+
+        return wrapper
+
+    def triggered(self):
+        """Inputs that changed for this request and the requests it replaced, as ``prop_id`` strings."""
+        if 'coalesced_triggers' in flask.g:
+            return flask.g.coalesced_triggers
+        return {trigger['prop_id'] for trigger in dash.callback_context.triggered if trigger['prop_id'] != '.'}
+
+    def stats(self):
+        with self._lock:
+            return {'received': self.received,
+                    'computed': self.computed,
+                    'skipped': self.skipped,
+                    'pending': sum(group.waiting for group in self._groups.values())}
+
+    def init_app(self, server):
+        """Tag each browser with a session cookie and expose the counters."""
+        @server.after_request
+        def set_session_cookie(response):
+            if SESSION_COOKIE not in flask.request.cookies:
+                response.set_cookie(SESSION_COOKIE, flask.g.get('session_id') or uuid.uuid4().hex,
+                                    httponly=True, samesite='Lax')
+            return response
+
+        server.add_url_rule('/_scheduler-stats', 'scheduler_stats', lambda: flask.jsonify(self.stats()))
+
+
+class _Group:
+    def __init__(self):
+        self.running = threading.Lock()
+        self.latest = 0
+        self.waiting = 0
+        # Triggers of the requests since the last one that ran.
+        self.triggered = set()
+
+
+def session_id():
+    session = flask.request.cookies.get(SESSION_COOKIE)
+    if session is None:
+        # No cookie yet: the request gets a group of its own and the id is
+        # handed out in the response cookie for the following ones.
+        session = flask.g.setdefault('session_id', uuid.uuid4().hex)
+    return session
+
+
+coalesce = Coalescer()
@@ -0,0 +1,108 @@
+"""Production entry point: preload the dataset once, then fork workers.
+
+The master process imports the app (columnar load, DataCube indexes,
+templates) before forking, so every worker starts with the data already in
+memory and shares those pages copy-on-write. Heavy data lives in numpy
+arrays and categorical codes rather than per-row Python objects, and the
+garbage collector is frozen after loading, so workers do not dirty the
+shared pages by touching reference counts or GC headers.
+
+Uses gunicorn when it is installed and a small built-in prefork server
+otherwise.
+
+    python serve.py --bind 0.0.0.0:8050 --workers 4
+    gunicorn 'serve:create_app()' --preload --workers 4 --threads 4
+"""
+import argparse
+import gc
+import logging
+import os
+import signal
+import socket
+import sys
+
+logger = logging.getLogger(__name__)
+
+
+def create_app():
+    """Load the dataset and return the Flask server behind the Dash app."""
+    import index
+
+    gc.collect()
+    gc.freeze()
+    return index.app.server
+
+
+def serve_gunicorn(server, bind, workers, threads):
+    from gunicorn.app.base import BaseApplication
+
+    class Application(BaseApplication):
+        def load_config(self):
+            self.cfg.set('bind', bind)
+            self.cfg.set('workers', workers)
+            self.cfg.set('threads', threads)
+            self.cfg.set('preload_app', True)
+
+        def load(self):
+            return server
+
+    Application().run()
+
+
+def serve_prefork(server, bind, workers, threads):
+    """Bind once in the master and fork ``workers`` werkzeug servers on that socket."""
+    from werkzeug.serving import make_server
+
+    host, port = bind.rsplit(':', 1)
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind((host, int(port)))
+    listener.listen(128)
+    listener.set_inheritable(True)
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            make_server(host, int(port), server, threaded=threads > 1, fd=listener.fileno()).serve_forever()
+            os._exit(0)
+        return pid
+
+    children = {spawn() for _ in range(workers)}
+    logger.info('serving on %s with %d workers', bind, workers)
+
+    def stop(signum, frame):
+        for pid in children:
+            os.kill(pid, signal.SIGTERM)
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    while True:
+        pid, status = os.wait()
+        if pid in children:
+            children.discard(pid)
+            logger.warning('worker %d exited with status %d, restarting', pid, status)
+            children.add(spawn())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--bind', default='0.0.0.0:8050')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--threads', type=int, default=4)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    server = create_app()
+    try:
+        import gunicorn  # noqa: F401
+    except ImportError:
+        serve_prefork(server, args.bind, args.workers, args.threads)
+    else:
+        serve_gunicorn(server, args.bind, args.workers, args.threads)
+
+
+if __name__ == '__main__':
+    main()
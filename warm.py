@@ -0,0 +1,62 @@
+"""Pre-render the dashboard's callback results into an on-disk store.
+
+The interaction space is finite: KPI cards per continent and year range,
+the line_chart series per country, and the first table page per country
+and year range. The chart itself is built in the browser from the series,
+so the year range and metric need no states of their own. Every state is
+computed in parallel across processes and written to a ``WarmStore`` file
+next to the columnar store, keyed like the memoization cache; running
+workers pick it up within seconds and only compute what it lacks.
+
+Run it after each data refresh, with the same environment as the app:
+
+    python warm.py --workers 8
+"""
+import argparse
+import concurrent.futures
+import multiprocessing
+import os
+import pickle
+import time
+
+import index
+from cache import WarmStore, memoize
+
+
+def states():
+    cube = index.cube
+    years = index.year_list
+    spans = [[low, high] for i, low in enumerate(years) for high in years[i:]]
+    for continent in cube.continents:
+        for span in spans:
+            yield 'kpi_cards', (continent, span)
+        for country in cube.countries(continent):
+            yield 'series_data', (continent, [country], None)
+            for span in spans:
+                yield 'table_page', (continent, [country], span, 0, 15, [])
+
+
+def render(state):
+    name, args = state
+    value = getattr(index, name).__wrapped__(*args)
+    return memoize.key(name, args), pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--chunk', type=int, default=256, help='states handed to a worker at a time')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    path = memoize.store.path
+    # Workers fork from this process, so the data is loaded only once.
+    context = multiprocessing.get_context('fork')
+    with concurrent.futures.ProcessPoolExecutor(args.workers, mp_context=context) as executor:
+        count = WarmStore.write(path, executor.map(render, states(), chunksize=args.chunk))
+    print('wrote %d states to %s (%.1f MB) in %.1f s' % (
+        count, path, os.path.getsize(path) / 2 ** 20, time.perf_counter() - start))
+
+
+if __name__ == '__main__':
+    main()